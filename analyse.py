@@ -5,96 +5,96 @@ Chuan-Zheng Lee <czlee@stanford.edu>
 November 2014
 """
 import argparse
-from electorate import ElectorateStatistics
+import report
+import timings
+from electorate import ElectorateStatistics, NationalStatistics, electorate_directory, load_electorates, load_years
 from config import *
 
 parser = argparse.ArgumentParser(description=__doc__)
-parser.add_argument("year", nargs="?", type=int, default=2014)
-actions = parser.add_argument_group("actions")
-actions.add_argument("-t", "--total", action="store_true", help="National totals")
-actions.add_argument("-e", "--electorate", nargs="+", metavar="ID", type=int, default=[], help="Specific electorate, ID is the electorate number")
-actions.add_argument("-r", "--compare-overall", action="store_true", help="National specials comparisons for all years")
-actions.add_argument("-s", "--compare-electorate", action="store_true", help="Specials comparisons by electorate")
-options = parser.add_argument_group("options")
-options.add_argument("-d", "--diffs", action="store_true", help="Use differences instead of ratios in overseas vs specials comparisons")
-options.add_argument("-v", "--votes", action="store_true", help="In --total or --electorate, also print raw vote counts")
-options.add_argument("-P", "--all-parties", action="store_true", help="Print all parties, not just significant ones")
-args = parser.parse_args()
+actions, options = report.add_arguments(parser)
+actions.add_argument("-l", "--list-electorates", action="store_true", help="List the electorates and their numbers")
+options.add_argument("--bootstrap", type=int, metavar="N", default=0, help="In comparisons, also print bootstrap confidence intervals from N resamples")
+options.add_argument("--confidence", type=float, default=0.95, help="Confidence level of --bootstrap intervals (default %(default)s)")
+options.add_argument("--seed", type=int, default=None, help="Random seed for --bootstrap, for repeatable intervals")
+options.add_argument("--no-check", action="store_true", help="Skip the totals check on each electorate, e.g. if validate.py has checked the year")
+options.add_argument("-j", "--jobs", type=int, default=1, help="Parse results files in this many processes (0 for one per core)")
+diagnostics = parser.add_argument_group("diagnostics")
+diagnostics.add_argument("--timings", action="store_true", help="Print time spent downloading, parsing, aggregating and formatting")
+diagnostics.add_argument("--timings-json", metavar="FILE", type=argparse.FileType("w"), help="Write the same timings, per electorate, as JSON to this file")
+diagnostics.add_argument("--profile", metavar="FILE", help="Save cProfile statistics for this run to this file (this process only)")
+def print_comparisons(args, labels, stats_list, type):
+    if args.bootstrap:
+        report.print_comparison_intervals(labels, stats_list, MAJOR_PARTIES, type, args.bootstrap, args.confidence, args.seed)
+    else:
+        report.print_comparisons(labels, stats_list, MAJOR_PARTIES, type)
 
-if not any([args.total, args.compare_electorate, args.compare_overall, args.electorate]):
-    parser.print_usage()
-
-def print_stats(stats, type="percentage"):
-    functions = {
-        "percentage": lambda x: "{0:8.2%}".format(getattr(stats, x).percentages[party]),
-        "votes"     : lambda x: str(getattr(stats, x).votes[party]).rjust(8),
-    }
-    attributes = ["ordinary", "ordinary_polling_places", "advance", "domestic", "specials", "specials_domestic", "overseas", "totals"]
-    print("Party".ljust(35) + "Ordinary   Polling   Advance  Domestic  Specials  DomSpecs  Overseas     Total")
+def print_stats(args, stats, type="percentage"):
     parties = args.all_parties and stats.parties or PARTIES[args.year]
-    for party in parties:
-        print(party[:35].ljust(35) + "  ".join(map(functions[type], attributes)))
+    report.print_stats(stats, parties, type)
 
-def print_comparison(stats, line, type):
-    for party in MAJOR_PARTIES:
-        overseas = stats.overseas.percentages[party]
-        domestic = stats.domestic.percentages[party]
-        specials_domestic = stats.specials_domestic.percentages[party]
-        specials = stats.specials.percentages[party]
-        ordinary = stats.ordinary.percentages[party]
-        if type == "ratio":
-            line += "     {0:>7.4f}  {1:>7.4f}  {2:>7.4f}  {3:>7.4f}  {4:>7.4f}".format(
-                    overseas/domestic, overseas/specials_domestic,
-                    overseas/ordinary, specials_domestic/ordinary,
-                    specials/ordinary)
-        elif type == "diff":
-            line += "     {0:>+7.2%}  {1:>+7.2%}  {2:>+7.2%}  {3:>+7.2%}  {4:>+7.2%}".format(
-                    overseas-domestic, overseas-specials_domestic,
-                    overseas-ordinary, specials_domestic-ordinary,
-                    specials-ordinary)
-        else:
-            raise ValueError("Unrecognized type: {0!r}".format(type))
-    print(line)
+def main():
+    args = parser.parse_args()
+    jobs = args.jobs or None
 
-if args.total:
-    total = ElectorateStatistics(args.year, 1)
-    for elec_id in range(2, NUM_ELECTORATES[args.year]+1):
-        total += ElectorateStatistics(args.year, elec_id)
-    print("National statistics for {0:d} election:".format(args.year))
-    print_stats(total, "percentage")
-    if args.votes:
-        print()
-        print_stats(total, "votes")
+    if args.no_check:
+        ElectorateStatistics.check_totals = False
+    if args.timings or args.timings_json:
+        timings.enabled = True
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if not any([args.total, args.compare_electorate, args.compare_overall, args.electorate, args.list_electorates]):
+        parser.print_usage()
+
+    if args.list_electorates:
+        print("Electorates in {0:d} election:".format(args.year))
+        for elec_id, entry in sorted(electorate_directory(args.year).items()):
+            print("{0:3d}  {1:s}".format(elec_id, entry["name"]))
 
-if args.compare_overall or args.compare_electorate:
-    print("All {type}s are percentage-to-percentage.\n".format(type=args.diffs and "difference" or "ratio"))
-    compare_type = args.diffs and "diff" or "ratio"
-    COMPARISONS_HEADER = "     Ovs/Dom   Ovs/DS  Ovs/Ord   DS/Ord Spec/Ord" * len(MAJOR_PARTIES)
-    if args.diffs:
-        COMPARISONS_HEADER = COMPARISONS_HEADER.replace("/", "-")
+    if args.total:
+        total = NationalStatistics(args.year, jobs=jobs)
+        print("National statistics for {0:d} election:".format(args.year))
+        print_stats(args, total, "percentage")
+        if args.votes:
+            print()
+            print_stats(args, total, "votes")
 
-    if args.compare_overall:
-        print(" " * 27 + "Greens" + " " * 42 + "Labour" + " " * 41 + "National")
-        print("Year" + COMPARISONS_HEADER)
-        for year in YEARS:
-            total = ElectorateStatistics(year, 1)
-            for elec_id in range(2, NUM_ELECTORATES[year]+1):
-                total += ElectorateStatistics(year, elec_id)
-            line = str(year)
-            print_comparison(total, line, compare_type)
+    if args.compare_overall or args.compare_electorate:
+        print("All {type}s are percentage-to-percentage.\n".format(type=args.diffs and "difference" or "ratio"))
+        compare_type = args.diffs and "diff" or "ratio"
+        if args.bootstrap:
+            print("Each line is followed by {0:.0%} bootstrap confidence intervals from {1:d} resamples.\n".format(args.confidence, args.bootstrap))
 
-    if args.compare_electorate:
-        print("Election {0:d}".format(args.year) + " " * 31 + "Greens" + " " * 42 + "Labour" + " " * 41 + "National")
-        print("Electorate           " + COMPARISONS_HEADER)
-        for elec_id in range(1, NUM_ELECTORATES[args.year]+1):
-            es = ElectorateStatistics(args.year, elec_id)
-            line = es.name.rjust(21)
-            print_comparison(es, line, compare_type)
+        if args.compare_overall:
+            report.print_comparisons_heading("", "Year", compare_type)
+            totals = load_years(YEARS, jobs)
+            print_comparisons(args, [str(year) for year in YEARS], [totals[year] for year in YEARS], compare_type)
 
-for elec_id in args.electorate:
-    es = ElectorateStatistics(args.year, elec_id)
-    print("Statistics for electorate {0:d} - {1:s} in {2:d} election".format(es.id, es.name, args.year))
-    print_stats(es)
-    if args.votes:
+        if args.compare_electorate:
+            report.print_comparisons_heading("Election {0:d}".format(args.year), "Electorate           ", compare_type)
+            keys = [(args.year, elec_id) for elec_id in range(1, NUM_ELECTORATES[args.year]+1)]
+            electorates = load_electorates(keys, jobs)
+            electorates = [electorates[key] for key in keys]
+            print_comparisons(args, [es.name.rjust(21) for es in electorates], electorates, compare_type)
+
+    for elec_id in args.electorate:
+        es = ElectorateStatistics(args.year, elec_id)
+        print("Statistics for electorate {0:d} - {1:s} in {2:d} election".format(es.id, es.name, args.year))
+        print_stats(args, es)
+        if args.votes:
+            print()
+            print_stats(args, total, "votes")
+
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if args.timings:
         print()
-        print_stats(total, "votes")
+        timings.print_summary()
+    if args.timings_json:
+        timings.write_json(args.timings_json)
+
+if __name__ == "__main__":
+    main()
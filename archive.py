@@ -0,0 +1,128 @@
+"""Single-file archives of a year's results files.
+
+An archive, results/<year>.pack, holds the contents of every results file in
+results/<year>/, one after another, with a table of where each one starts.
+It's read through a memory map, so a file is read from the archive without
+extracting it, and a whole year costs one open. A results file that exists
+on its own takes precedence over its copy in the archive, so files that are
+downloaded again after packing are still used.
+
+The file layout is:
+    8 bytes    magic, b"NZELPACK"
+    8 bytes    length of the header, little-endian unsigned
+    header     JSON, UTF-8, with an offset, size and SHA-256 for each member
+    members    each file's contents
+Member offsets in the header are relative to the end of the header.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import hashlib
+import mmap
+import os
+import threading
+import container
+
+MAGIC = b"NZELPACK"
+VERSION = 1
+
+_archives = dict() # archive filename -> Archive
+_lock = threading.Lock()
+
+def get_archive_filename(dirname):
+    """Returns the archive filename for a year's results directory."""
+    return os.path.normpath(dirname) + ".pack"
+
+
+class Archive(object):
+    """An archive opened for reading."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header, self._start = container.read_header(self._mmap, MAGIC, VERSION, filename, "results archive")
+        self.members = header["members"]
+
+    def read(self, name, size=None):
+        """Returns the contents of a member, as bytes, or only the first 'size'
+        bytes if 'size' is given."""
+        info = self.members[name]
+        offset = self._start + info["offset"]
+        size = info["size"] if size is None else min(size, info["size"])
+        return self._mmap[offset:offset+size]
+
+
+def write_archive(filename, members):
+    """Writes an archive of 'members', a dict mapping names to contents."""
+    table = dict()
+    offset = 0
+    for name, content in members.items():
+        table[name] = {"offset": offset, "size": len(content), "sha256": hashlib.sha256(content).hexdigest()}
+        offset += len(content)
+    with container.atomic_write(filename) as f:
+        container.write_header(f, MAGIC, {"version": VERSION, "members": table})
+        for content in members.values():
+            f.write(content)
+
+def _member(filename):
+    """Returns the archive and member name for a results file that isn't on
+    disk by itself, or (None, None) if no archive has it."""
+    dirname, name = os.path.split(filename)
+    archive_filename = get_archive_filename(dirname)
+    try:
+        mtime_ns = os.stat(archive_filename).st_mtime_ns
+    except FileNotFoundError:
+        return None, None
+    with _lock:
+        archive = _archives.get(archive_filename)
+        if archive is None or archive.mtime_ns != mtime_ns:
+            archive = _archives[archive_filename] = Archive(archive_filename)
+    if name not in archive.members:
+        return None, None
+    return archive, name
+
+def results_stat(filename):
+    """Returns a tuple (size, version) for a results file, where 'version'
+    changes whenever the file does, or None if the file isn't on disk or in
+    an archive."""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        archive, name = _member(filename)
+        if archive is None:
+            return None
+        info = archive.members[name]
+        return info["size"], info["sha256"]
+    return st.st_size, st.st_mtime_ns
+
+def read_results(filename, size=None):
+    """Returns the contents of a results file, as bytes, from disk or from an
+    archive. If 'size' is given, at most that many bytes are read."""
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            return f.read(size)
+    archive, name = _member(filename)
+    if archive is None:
+        raise FileNotFoundError("'{0}' isn't on disk or in an archive".format(filename))
+    return archive.read(name, size)
+
+def pack(dirname, remove=True):
+    """Packs the .csv files in 'dirname', with any members of its existing
+    archive that haven't been replaced, into its archive. Unless 'remove' is
+    False, the packed files are then removed. Returns the number of members."""
+    archive_filename = get_archive_filename(dirname)
+    members = dict()
+    if os.path.exists(archive_filename):
+        archive = Archive(archive_filename)
+        for name in archive.members:
+            members[name] = archive.read(name)
+    loose = sorted(name for name in os.listdir(dirname) if name.endswith(".csv"))
+    for name in loose:
+        with open(os.path.join(dirname, name), 'rb') as f:
+            members[name] = f.read()
+    write_archive(archive_filename, dict(sorted(members.items())))
+    if remove:
+        for name in loose:
+            os.remove(os.path.join(dirname, name))
+    return len(members)
@@ -0,0 +1,134 @@
+"""Benchmarks for parsing, aggregation and report rendering.
+
+Every benchmark runs on synthetic results files (see synthetic.py) written to
+a temporary directory, so nothing is downloaded. Results are saved as JSON,
+and can be compared against an earlier run to catch regressions.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import synthetic
+from config import NUM_ELECTORATES
+from electorate import ElectorateStatistics, NationalStatistics, load_electorates
+
+YEARS = [1999, 2014, 2020] # one of each file layout
+SCALES = [(60, 10), (250, 10), (250, 30), (1000, 20)] # (polling places, parties)
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def timeit(func, repeat):
+    """Runs func() 'repeat' times and returns the times taken, in seconds."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+def run_analyse(*args):
+    subprocess.run([sys.executable, os.path.join(ROOT, "analyse.py")] + list(args),
+            check=True, stdout=subprocess.DEVNULL)
+
+def benchmark_year(year, nbooths, nparties, repeat, quick):
+    """Runs all benchmarks for one year and scale, in the current directory."""
+    nelectorates = 5 if quick else NUM_ELECTORATES[year]
+    synthetic.generate_year(year, nbooths, nparties, nelectorates)
+    keys = [(year, elec_id) for elec_id in range(1, nelectorates+1)]
+    results = dict()
+
+    def parse():
+        for year_, elec_id in keys:
+            ElectorateStatistics(year_, elec_id, use_cache=False)
+    results["parse"] = timeit(parse, repeat)
+
+    load_electorates(keys) # warm the cache
+    def parse_cached():
+        for year_, elec_id in keys:
+            ElectorateStatistics(year_, elec_id)
+    results["parse_cached"] = timeit(parse_cached, repeat)
+
+    electorates = list(load_electorates(keys).values())
+    def add():
+        total = electorates[0]
+        for es in electorates[1:]:
+            total += es
+    results["add"] = timeit(add, repeat)
+
+    def aggregate():
+        national = NationalStatistics(year, init=False)
+        national.set_electorates(electorates)
+    results["aggregate"] = timeit(aggregate, repeat)
+
+    if not quick:
+        results["report_total"] = timeit(lambda: run_analyse("--total", "--votes", str(year)), repeat)
+        results["report_compare_electorate"] = timeit(lambda: run_analyse("--compare-electorate", str(year)), repeat)
+
+    return results
+
+def run(repeat, quick):
+    results = list()
+    cwd = os.getcwd()
+    for nbooths, nparties in SCALES[:1] if quick else SCALES:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.chdir(tmpdir) # results and cache directories are relative
+            for year in YEARS:
+                times = benchmark_year(year, nbooths, nparties, repeat, quick)
+                for name, values in times.items():
+                    results.append({"benchmark": name, "year": year, "booths": nbooths, "parties": nparties,
+                            "min": min(values), "median": statistics.median(values)})
+                    print("{benchmark:<26} {year:d} {booths:5d} booths {parties:3d} parties  "
+                          "min {min:9.4f} s  median {median:9.4f} s".format(**results[-1]))
+            os.chdir(cwd)
+    return results
+
+def compare(results, baseline, threshold):
+    """Prints benchmarks whose minimum time is more than 'threshold' times
+    that of the same benchmark in 'baseline'. Returns the number of them."""
+    key = lambda r: (r["benchmark"], r["year"], r["booths"], r["parties"])
+    baseline = {key(r): r for r in baseline}
+    regressions = 0
+    for result in results:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        ratio = result["min"] / before["min"]
+        if ratio > threshold:
+            regressions += 1
+            print("Regression: {0[0]} {0[1]} {0[2]} booths {0[3]} parties: {1:.4f} s -> {2:.4f} s ({3:.2f}x)".format(
+                    key(result), before["min"], result["min"], ratio))
+    return regressions
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Times to run each benchmark")
+    parser.add_argument("-q", "--quick", action="store_true", help="Only a few electorates at the smallest scale, without reports")
+    parser.add_argument("-o", "--output", help="Write results to this JSON file (default: a new file in benchmarks/results)")
+    parser.add_argument("-c", "--compare", metavar="FILE", help="Compare against results in this JSON file")
+    parser.add_argument("-t", "--threshold", type=float, default=1.2, help="Ratio counted as a regression (default %(default)s)")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    results = run(args.repeat, args.quick)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+    print("Results written to {0}".format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
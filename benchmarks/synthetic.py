@@ -0,0 +1,138 @@
+"""Generates synthetic polling place results files, for benchmarking.
+
+The files follow the layouts that ElectorateStatistics parses: the 1999
+per-name files, the 2002-2014 e9_part8 files and the 2017-2020
+votes-by-voting-place files. Each file gets a manifest entry, so download.py
+treats it as already downloaded and never goes to the network.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import csv
+import hashlib
+import io
+import itertools
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import download
+from config import ELECTORATE_NAMES_1999, NUM_ELECTORATES, PARTIES
+
+SPECIAL_ROWS = [
+    "Ordinary Votes BEFORE polling day",
+    "Special Votes BEFORE polling day",
+    "Special Votes On polling day",
+    "Overseas Special Votes including Defence Force",
+    "Votes Allowed for Party Only",
+]
+
+def get_parties(year, nparties):
+    """Returns 'nparties' party names, starting with the real ones for the year."""
+    parties = PARTIES[year][:nparties]
+    parties += ["Synthetic Party {0:d}".format(i) for i in range(1, nparties - len(parties) + 1)]
+    return parties
+
+def get_electorate_name(year, elec_id):
+    if year == 1999:
+        return ELECTORATE_NAMES_1999[elec_id-1]
+    return "Synthetic Electorate {0:d}".format(elec_id)
+
+def get_candidates(parties):
+    """Returns candidate names and their affiliations: one candidate for each
+    of the first few parties, and an independent."""
+    affiliations = parties[:6] + [""]
+    candidates = ["CANDIDATE {0:d}, Synthetic".format(i) for i in range(1, len(affiliations)+1)]
+    return candidates, affiliations
+
+def generate_file(year, elec_id, nbooths, nparties, seed=0, vote_type="party"):
+    """Returns the contents of a synthetic results file, as bytes. For
+    candidate files, 'nparties' is the number of parties on the party vote
+    file, from which candidate affiliations are taken."""
+    rng = random.Random("{0}-{1}-{2}-{3}".format(seed, year, elec_id, vote_type))
+    parties = get_parties(year, nparties)
+    if vote_type == "cand":
+        parties, affiliations = get_candidates(parties)
+        nparties = len(parties)
+    name = get_electorate_name(year, elec_id)
+    weights = [0.05 + rng.random() ** 2 for party in parties]
+    extra_columns = 2 if year == 1999 else 0 # 1999 has four total columns, others two
+    label = "Candidate" if vote_type == "cand" else "Party"
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\r\n")
+    if year == 1999:
+        writer.writerow(["{0:s} {1:d} {2:s} Vote Results".format(name.upper(), elec_id, label), ""] + parties +
+                ["Total Valid {0:s} Votes".format(label), "Informal {0:s} Votes".format(label), "", ""])
+    else:
+        writer.writerow(["Official Count Results -- Polling Place Statistics"])
+        writer.writerow(["{0:s} {1:d}".format(name, elec_id)])
+        writer.writerow(["", ""] + parties + ["Total Valid {0:s} Votes".format(label), "Informal {0:s} Votes".format(label)])
+    if vote_type == "cand":
+        writer.writerow(["", ""] + affiliations + ["", ""] + [""] * extra_columns)
+
+    totals = [0] * nparties
+
+    def write_row(suburb, location, size):
+        votes = [int(rng.expovariate(1) * size * weight) for weight in weights]
+        for i, v in enumerate(votes):
+            totals[i] += v
+        writer.writerow([suburb, location] + votes + [sum(votes), rng.randint(0, 10)] + [0] * extra_columns)
+
+    for booth in range(nbooths):
+        # Suburbs usually cover a few consecutive polling places
+        suburb = "Suburb {0:d}".format(booth // 3) if booth % 3 == 0 else ""
+        if booth % 7 == 0:
+            location = "St Booth's School, {0:d} Main Road".format(booth)
+        else:
+            location = "Synthetic School {0:d}".format(booth)
+        write_row(suburb, location, 40)
+        if booth % 25 == 24:
+            writer.writerow([])
+
+    if year == 2020 or year == 2017:
+        write_row("", "Voting Places where Less than 6 Votes were Taken", 1)
+    elif year != 1999:
+        write_row("", "Polling Places where Less than 6 Votes were Taken", 1)
+    for row_label in SPECIAL_ROWS[:4] if year == 1999 or vote_type == "cand" else SPECIAL_ROWS:
+        write_row("", row_label, 5 * nbooths)
+    writer.writerow(["", "{0:s} Total".format(name)] + totals + [sum(totals), 0] + [0] * extra_columns)
+
+    return out.getvalue().encode("utf-8")
+
+def generate_year(year, nbooths, nparties, nelectorates=None, seed=0, vote_types=("party",)):
+    """Writes synthetic results files for a year into download.RESULTS_DIR,
+    and records them in the year's manifest. Returns the number of bytes
+    written."""
+    manifest = download.get_manifest(year)
+    nbytes = 0
+    for elec_id, vote_type in itertools.product(range(1, (nelectorates or NUM_ELECTORATES[year])+1), vote_types):
+        content = generate_file(year, elec_id, nbooths, nparties, seed, vote_type)
+        filename = download.get_filename(year, elec_id, vote_type)
+        download.write_atomically(filename, content)
+        manifest.update(filename, {
+            "url": download.get_details_file_url(year, elec_id, vote_type),
+            "etag": None,
+            "last_modified": None,
+            "size": len(content),
+            "sha256": hashlib.sha256(content).hexdigest(),
+        })
+        nbytes += len(content)
+    return nbytes
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("year", nargs="+", type=int)
+    parser.add_argument("-b", "--booths", type=int, default=60, help="Polling places per electorate")
+    parser.add_argument("-p", "--parties", type=int, default=12, help="Number of parties")
+    parser.add_argument("-o", "--output", default=download.RESULTS_DIR, help="Results directory to write to")
+    parser.add_argument("-c", "--candidates", action="store_true", help="Also write candidate vote files")
+    args = parser.parse_args()
+
+    download.RESULTS_DIR = args.output
+    vote_types = ("party", "cand") if args.candidates else ("party",)
+    for year in args.year:
+        nbytes = generate_year(year, args.booths, args.parties, vote_types=vote_types)
+        print("{0:d}: {1:,d} bytes".format(year, nbytes))
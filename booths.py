@@ -0,0 +1,253 @@
+# coding: utf-8
+"""Cross-election polling place index.
+
+Polling places are matched across elections by their suburb and location,
+after normalizing case, punctuation, macrons and common abbreviations. Each
+normalized suburb and location is hashed, and each hash gets a booth ID that
+stays the same when the index is rebuilt. The key is built the same way in
+every year, so a booth keeps its ID across elections, and polling places with
+the same location in different suburbs are never merged. A polling place
+that appears in several electorates' files in the same year is one booth.
+
+The index keeps each polling place's votes for every year it appears in,
+against the union of all years' parties (by their canonical names in the
+party registry), so a time series for a booth is read straight from the
+index, without loading any results files.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import hashlib
+import os
+import re
+import unicodedata
+import numpy
+import container
+import download
+from config import NUM_ELECTORATES, YEARS
+from electorate import load_electorates
+from parties import registry as party_registry
+
+INDEX_VERSION = 3
+
+ABBREVIATIONS = {
+    "rd": "road",
+    "ave": "avenue",
+    "cres": "crescent",
+    "tce": "terrace",
+    "pde": "parade",
+    "hwy": "highway",
+    "sch": "school",
+    "ctr": "centre",
+    "cntr": "centre",
+    "center": "centre",
+    "mem": "memorial",
+    "nth": "north",
+    "sth": "south",
+}
+
+def get_index_filename():
+    """Returns the filename of the booth index."""
+    return os.path.join(download.RESULTS_DIR, "booths.npz")
+
+def normalize_location(location):
+    """Returns a normalized form of a polling place location, for matching."""
+    text = unicodedata.normalize("NFKD", location)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = text.replace("&", " and ").replace("'", "").replace("’", "")
+    words = re.sub(r"[^a-z0-9]+", " ", text).split()
+    return " ".join(ABBREVIATIONS.get(word, word) for word in words)
+
+def booth_key(location, suburb):
+    """Returns the key that identifies a polling place in every year."""
+    return normalize_location(suburb or "") + "|" + normalize_location(location)
+
+def location_hash(key):
+    """Returns a 64-bit hash of a normalized location key."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+class BoothIndex(object):
+    """Booths and their appearances in each election.
+
+    'hashes' and 'locations' have one entry per booth, indexed by booth ID.
+    The occurrence arrays ('booth', 'year', 'electorate', 'id', 'total' and
+    'votes') have one entry per polling place in a results file, sorted by
+    booth and then year; 'offsets' marks where each booth's occurrences
+    start. 'votes' has a column for each of 'parties'.
+    """
+
+    OCCURRENCE_FIELDS = ["booth", "year", "electorate", "id", "total", "votes"]
+
+    def __init__(self, hashes, locations, parties, occurrences):
+        self.hashes = numpy.asarray(hashes, dtype=numpy.uint64)
+        self.locations = list(locations)
+        self.parties = list(parties)
+        self.occurrences = occurrences
+        self._ids = {h: booth for booth, h in enumerate(self.hashes.tolist())}
+        self._by_location = dict() # normalized location -> booth IDs
+        for booth, location in enumerate(self.locations):
+            self._by_location.setdefault(normalize_location(location), []).append(booth)
+        self._party_columns = {party: i for i, party in enumerate(self.parties)}
+        self.offsets = numpy.searchsorted(occurrences["booth"], numpy.arange(len(self.hashes) + 1))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def lookup(self, location, suburb=None):
+        """Returns the booth ID for this location, or None if it isn't in the
+        index. Without 'suburb' (or if there's no booth in that suburb), the
+        location alone is used, if only one booth has it."""
+        if suburb is not None:
+            booth = self._ids.get(location_hash(booth_key(location, suburb)))
+            if booth is not None:
+                return booth
+        booths = self._by_location.get(normalize_location(location), [])
+        return booths[0] if len(booths) == 1 else None
+
+    def search(self, text):
+        """Returns the IDs of booths whose normalized location contains the
+        normalized 'text'."""
+        text = normalize_location(text)
+        return [booth for booth, location in enumerate(self.locations) if text in normalize_location(location)]
+
+    def booth_occurrences(self, booth):
+        """Returns a dict of the occurrence arrays for this booth."""
+        start, stop = self.offsets[booth:booth+2]
+        return {name: array[start:stop] for name, array in self.occurrences.items()}
+
+    def series(self, booth, party):
+        """Returns a list of (year, electorates, votes, share) tuples, one for
+        each election this booth appears in, where 'votes' is the number of
+        votes for 'party' and 'share' is its fraction of all votes at the
+        booth, summed over 'electorates'."""
+        occurrences = self.booth_occurrences(booth)
+        years = occurrences["year"]
+        if len(years) == 0:
+            return []
+        starts = numpy.flatnonzero(numpy.r_[True, years[1:] != years[:-1]])
+        column = self._party_columns.get(party_registry.canonical(party))
+        if column is None:
+            votes = numpy.zeros(len(starts), dtype=numpy.int64)
+        else:
+            votes = numpy.add.reduceat(occurrences["votes"][:, column], starts)
+        totals = numpy.add.reduceat(occurrences["total"], starts)
+        shares = votes / numpy.where(totals == 0, 0.1, totals)
+        electorates = numpy.split(occurrences["electorate"], starts[1:])
+        return [(year, e.tolist(), v, share) for year, e, v, share in
+                zip(years[starts].tolist(), electorates, votes.tolist(), shares.tolist())]
+
+    def save(self, filename):
+        """Writes the index to a NumPy .npz file."""
+        arrays = {"occ_" + name: array for name, array in self.occurrences.items()}
+        with container.atomic_write(filename) as f:
+            numpy.savez(f, version=INDEX_VERSION, hashes=self.hashes,
+                    locations=numpy.array(self.locations, dtype=str), parties=numpy.array(self.parties, dtype=str), **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """Reads an index written by save()."""
+        with numpy.load(filename) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError("'{0}' is version {1}, expected {2}".format(filename, int(data["version"]), INDEX_VERSION))
+            occurrences = {name: data["occ_" + name] for name in cls.OCCURRENCE_FIELDS}
+            return cls(data["hashes"], data["locations"].tolist(), data["parties"].tolist(), occurrences)
+
+
+def build_index(years=YEARS, jobs=1, previous=None):
+    """Builds a BoothIndex from the results files for 'years'. Booths in
+    'previous', an earlier BoothIndex, keep their IDs, and its occurrences in
+    other years are kept."""
+    if previous is None:
+        previous = BoothIndex([], [], [], {name: numpy.zeros((0,) * (1 + (name == "votes")), dtype=numpy.int64)
+                for name in BoothIndex.OCCURRENCE_FIELDS})
+    hashes = previous.hashes.tolist()
+    locations = list(previous.locations)
+    parties = list(previous.parties)
+    ids = {h: booth for booth, h in enumerate(hashes)}
+    party_columns = {party: i for i, party in enumerate(parties)}
+    columns = {name: [] for name in BoothIndex.OCCURRENCE_FIELDS}
+    spread = [] # party columns of each block of occurrences
+
+    keep = ~numpy.isin(previous.occurrences["year"], list(years))
+    for name, array in previous.occurrences.items():
+        columns[name].append(array[keep])
+    spread.append(list(range(len(parties))))
+
+    for year in years:
+        keys = [(year, elec_id) for elec_id in range(1, NUM_ELECTORATES[year]+1)]
+        electorates = load_electorates(keys, jobs)
+        electorates = [electorates[key] for key in keys]
+        for es in electorates:
+            names = [party_registry.canonical(party) for party in es.parties]
+            for name in names:
+                if name not in party_columns:
+                    party_columns[name] = len(parties)
+                    parties.append(name)
+            table = es.pprs
+            booths = []
+            for suburb, location in zip(table.suburbs.tolist(), table.locations.tolist()):
+                h = location_hash(booth_key(table.strings[location], table.strings[suburb]))
+                if h not in ids:
+                    ids[h] = len(hashes)
+                    hashes.append(h)
+                    locations.append(table.strings[location])
+                booths.append(ids[h])
+            columns["booth"].append(numpy.array(booths, dtype=numpy.int32))
+            columns["year"].append(numpy.full(len(table), year, dtype=numpy.int16))
+            columns["electorate"].append(numpy.full(len(table), es.id, dtype=numpy.int16))
+            columns["id"].append(table.ids)
+            columns["total"].append(table.votes.sum(axis=1))
+            columns["votes"].append(table.votes)
+            spread.append([party_columns[name] for name in names])
+
+    # Spread each block's votes into columns for the union of all parties
+    for i, (votes, party_index) in enumerate(zip(columns["votes"], spread)):
+        columns["votes"][i] = numpy.zeros((len(votes), len(parties)), dtype=numpy.int64)
+        columns["votes"][i][:, party_index] = votes
+
+    occurrences = {name: numpy.concatenate(arrays) for name, arrays in columns.items()}
+    order = numpy.lexsort((occurrences["year"], occurrences["booth"]))
+    occurrences = {name: array[order] for name, array in occurrences.items()}
+    return BoothIndex(hashes, locations, parties, occurrences)
+
+def open_index():
+    """Opens the booth index, or returns None if it hasn't been built."""
+    filename = get_index_filename()
+    if not os.path.exists(filename):
+        return None
+    return BoothIndex.load(filename)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    build_parser = subparsers.add_parser("build", help="Build or update the index")
+    build_parser.add_argument("year", nargs="*", type=int, default=YEARS)
+    build_parser.add_argument("-j", "--jobs", type=int, default=1, help="Parse results files in this many processes (0 for one per core)")
+    find_parser = subparsers.add_parser("find", help="List booths whose location contains some text")
+    find_parser.add_argument("text")
+    series_parser = subparsers.add_parser("series", help="Print a party's votes at a booth in each election")
+    series_parser.add_argument("booth", type=int)
+    series_parser.add_argument("party")
+    args = parser.parse_args()
+
+    if args.action == "build":
+        try:
+            previous = open_index()
+        except ValueError: # an older version of the index, with different keys
+            previous = None
+        index = build_index(args.year, args.jobs or None, previous)
+        index.save(get_index_filename())
+        print("{0}: {1:d} booths, {2:d} polling places".format(get_index_filename(), len(index), len(index.occurrences["booth"])))
+    else:
+        index = open_index()
+        if index is None:
+            parser.error("no booth index, run 'python booths.py build' first")
+        if args.action == "find":
+            for booth in index.search(args.text):
+                years = sorted(set(index.booth_occurrences(booth)["year"].tolist()))
+                print("{0:6d}  {1:s}  ({2:s})".format(booth, index.locations[booth], ", ".join(map(str, years))))
+        elif args.action == "series":
+            print("Booth {0:d} - {1:s}".format(args.booth, index.locations[args.booth]))
+            for year, electorates, votes, share in index.series(args.booth, args.party):
+                print("{0:d}  {1:8d}  {2:8.2%}  electorates {3:s}".format(year, votes, share, ", ".join(map(str, electorates))))
@@ -0,0 +1,125 @@
+"""On-disk cache of parsed polling place results files.
+
+Each results file is parsed once into a plain snapshot (parties, name, id,
+special row tallies and polling place rows), which is pickled alongside a
+fingerprint of the source file, taken before the file was read. A snapshot is
+only used if the fingerprint still matches, so replacing a results file
+invalidates its snapshot. Each year also has a directory of its electorates,
+read from the files' headers, which is kept with the fingerprints of all of
+the year's files.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import os
+import pickle
+import shutil
+import archive
+import container
+import timings
+
+CACHE_DIR = "cache"
+CACHE_VERSION = 5  # bump whenever the snapshot format changes
+
+def get_cache_filename(year, elec_id, vote_type):
+    """Returns the cache filename for this year, electorate and vote type."""
+    return os.path.join(CACHE_DIR, str(year), "electorate_{elec_id:d}_{type:s}.pickle".format(elec_id=elec_id, type=vote_type))
+
+def fingerprint(filename):
+    """Returns a fingerprint of the source file, which changes whenever the
+    file is replaced. The file may be in an archive."""
+    stat = archive.results_stat(filename)
+    if stat is None:
+        raise FileNotFoundError("'{0}' isn't on disk or in an archive".format(filename))
+    return (CACHE_VERSION,) + stat
+
+def load(year, elec_id, vote_type, key):
+    """Returns the cached snapshot for this file, or None if there isn't one
+    or it wasn't stored with 'key', the source file's current fingerprint."""
+    filename = get_cache_filename(year, elec_id, vote_type)
+    with timings.phase("cache-load", (year, elec_id)) as record:
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            stored_key, snapshot = pickle.loads(data)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        record.bytes += len(data)
+    if stored_key != key:
+        return None
+    return snapshot
+
+def store(year, elec_id, vote_type, key, snapshot):
+    """Writes the snapshot for this file to the cache. 'key' must be the
+    fingerprint of the source file taken before it was read, so that if the
+    file is replaced while it's being parsed, the snapshot isn't used."""
+    filename = get_cache_filename(year, elec_id, vote_type)
+    with container.atomic_write(filename) as f:
+        pickle.dump((key, snapshot), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def get_directory_filename(year):
+    """Returns the filename of the electorate directory for this year."""
+    return os.path.join(CACHE_DIR, str(year), "directory.pickle")
+
+def fingerprints(sources):
+    """Returns the fingerprints of the results files in 'sources', a dict
+    mapping electorate numbers to filenames, as a dict."""
+    return {elec_id: fingerprint(source) for elec_id, source in sources.items()}
+
+def load_directory(year, keys):
+    """Returns the cached electorate directory for this year, or None if there
+    isn't one or it wasn't stored with 'keys', the current fingerprints() of
+    the year's results files."""
+    try:
+        with open(get_directory_filename(year), 'rb') as f:
+            stored_keys, directory = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        return None
+    if stored_keys != keys:
+        return None
+    return directory
+
+def store_directory(year, keys, directory):
+    """Writes the electorate directory for this year to the cache. As with
+    store(), 'keys' must be taken before the files were read."""
+    filename = get_directory_filename(year)
+    with container.atomic_write(filename) as f:
+        pickle.dump((keys, directory), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def invalidate(year, elec_id, vote_type):
+    """Removes the cached snapshot for this file, if there is one."""
+    try:
+        os.remove(get_cache_filename(year, elec_id, vote_type))
+    except FileNotFoundError:
+        pass
+
+def clear(year=None):
+    """Removes all cached snapshots for the year, or for all years if 'year'
+    is None."""
+    dirname = CACHE_DIR if year is None else os.path.join(CACHE_DIR, str(year))
+    if os.path.isdir(dirname):
+        shutil.rmtree(dirname)
+
+def rebuild(year, quiet=False):
+    """Clears and re-parses every electorate for the year."""
+    from electorate import ElectorateStatistics
+    from config import NUM_ELECTORATES
+    clear(year)
+    for elec_id in range(1, NUM_ELECTORATES[year]+1):
+        ElectorateStatistics(year, elec_id)
+        if not quiet:
+            print("Cached {0:d} electorate {1:d}".format(year, elec_id))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("action", choices=["clear", "rebuild"])
+    parser.add_argument("year", nargs="*", type=int)
+    args = parser.parse_args()
+
+    if args.action == "clear":
+        for year in args.year or [None]:
+            clear(year)
+    elif args.action == "rebuild":
+        from config import YEARS
+        for year in args.year or YEARS:
+            rebuild(year)
@@ -0,0 +1,88 @@
+# coding: utf-8
+"""Client for the query server in server.py.
+
+Takes the same actions as analyse.py and prints the same tables, but gets
+its numbers from a running server, so nothing is loaded or parsed here.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import argparse
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy
+import report
+import server
+from config import PARTIES
+from electorate import GeneralStatistics
+
+DEFAULT_URL = "http://{0}:{1:d}/".format(server.DEFAULT_ADDRESS, server.DEFAULT_PORT)
+
+class ServerError(Exception):
+    pass
+
+def query(url, path, **params):
+    """Sends a query to the server at 'url' and returns the decoded answer."""
+    if params:
+        path += "?" + urllib.parse.urlencode(params)
+    try:
+        with urllib.request.urlopen(urllib.parse.urljoin(url, path)) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise ServerError(json.load(e).get("error", str(e)))
+
+def stats_from_json(result):
+    """Returns a GeneralStatistics from a /total or /electorate answer."""
+    array = numpy.array(result["votes"], dtype=numpy.int64)
+    assert result["fields"] == GeneralStatistics.BASIC_FIELDS
+    return GeneralStatistics.from_array(result["parties"], array)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    actions, options = report.add_arguments(parser)
+    options.add_argument("-u", "--url", default=DEFAULT_URL, help="Server URL (default %(default)s)")
+    args = parser.parse_args()
+
+    if not any([args.total, args.compare_electorate, args.compare_overall, args.electorate]):
+        parser.print_usage()
+
+    def print_stats(stats, type="percentage"):
+        parties = args.all_parties and stats.parties or PARTIES[args.year]
+        report.print_stats(stats, parties, type)
+
+    try:
+        if args.total:
+            total = stats_from_json(query(args.url, "total/{0:d}".format(args.year)))
+            print("National statistics for {0:d} election:".format(args.year))
+            print_stats(total, "percentage")
+            if args.votes:
+                print()
+                print_stats(total, "votes")
+
+        if args.compare_overall or args.compare_electorate:
+            print("All {type}s are percentage-to-percentage.\n".format(type=args.diffs and "difference" or "ratio"))
+            compare_type = args.diffs and "diff" or "ratio"
+
+            if args.compare_overall:
+                report.print_comparisons_heading("", "Year", compare_type)
+                result = query(args.url, "compare/overall", type=compare_type)
+                report.print_comparison_table(result["labels"], numpy.array(result["table"]), compare_type)
+
+            if args.compare_electorate:
+                report.print_comparisons_heading("Election {0:d}".format(args.year), "Electorate           ", compare_type)
+                result = query(args.url, "compare/electorates/{0:d}".format(args.year), type=compare_type)
+                labels = [name.rjust(21) for name in result["labels"]]
+                report.print_comparison_table(labels, numpy.array(result["table"]), compare_type)
+
+        for elec_id in args.electorate:
+            result = query(args.url, "electorate/{0:d}/{1:d}".format(args.year, elec_id))
+            es = stats_from_json(result)
+            print("Statistics for electorate {0:d} - {1:s} in {2:d} election".format(result["id"], result["name"], args.year))
+            print_stats(es)
+            if args.votes:
+                print()
+                print_stats(es, "votes")
+
+    except (ServerError, urllib.error.URLError) as e:
+        parser.exit(1, "{0}: error: {1}\n".format(parser.prog, e))
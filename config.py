@@ -56,7 +56,7 @@ PARTIES[2005] = [
     u"Green Party",
     u"Jim Anderton's Progressive",
     u"Labour Party",
-    u"M�ori Party",
+    u"Māori Party",
     u"National Party",
     u"New Zealand First Party",
     u"United Future New Zealand"]
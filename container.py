@@ -0,0 +1,64 @@
+"""Helpers for writing files safely, and for the single-file containers used
+by archive.py and store.py.
+
+A container starts with:
+    8 bytes    magic, identifying the kind of file
+    8 bytes    length of the header, little-endian unsigned
+    header     JSON, UTF-8, with at least a "version"
+What follows the header is up to each kind of file.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import contextlib
+import json
+import os
+import struct
+import tempfile
+
+PREFIX_LENGTH = 16 # magic and header length
+
+@contextlib.contextmanager
+def atomic_write(filename):
+    """Opens a temporary file for writing (in binary mode), and renames it to
+    'filename' when the block finishes, so that the file is never seen
+    partially written. If the block raises, the temporary file is removed."""
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=dirname or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            yield outfile
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+def write_atomically(filename, content):
+    """Writes 'content' (bytes) to a temporary file, then renames it to
+    'filename', so that the file is never seen partially written."""
+    with atomic_write(filename) as outfile:
+        outfile.write(content)
+
+def write_header(outfile, magic, header, length=None):
+    """Writes the magic and JSON header of a container to 'outfile'. If
+    'length' is given, the header is padded with spaces to that length."""
+    header_bytes = json.dumps(header).encode()
+    if length is not None:
+        header_bytes = header_bytes.ljust(length)
+    outfile.write(magic)
+    outfile.write(struct.pack("<Q", len(header_bytes)))
+    outfile.write(header_bytes)
+
+def read_header(buffer, magic, version, filename, kind):
+    """Reads the header of a container from 'buffer' (e.g. a memory map), and
+    checks its magic and version. 'filename' and 'kind' (e.g. "results
+    archive") are used in error messages. Returns the header and the offset
+    of the end of the header."""
+    if buffer[:len(magic)] != magic:
+        raise ValueError("'{0}' is not a {1}".format(filename, kind))
+    length, = struct.unpack_from("<Q", buffer, len(magic))
+    header = json.loads(bytes(buffer[PREFIX_LENGTH:PREFIX_LENGTH+length]).decode())
+    if header["version"] != version:
+        raise ValueError("'{0}' is version {1}, expected {2}".format(filename, header["version"], version))
+    return header, PREFIX_LENGTH + length
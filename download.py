@@ -3,15 +3,178 @@
 Chuan-Zheng Lee <czlee@stanford.edu>
 November 2014
 """
-import urllib.request
+import hashlib
+import http.client
+import json
 import os
+import sys
+import threading
 import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import archive
+import cache
+from container import write_atomically
+import timings
 from config import NUM_ELECTORATES, ELECTORATE_NAMES_1999
 
 URL_2017_2020 = "https://electionresults.govt.nz/electionresults_{year:d}/statistics/csv/{type:s}-votes-by-voting-place-{elec_id:d}.csv"
 URL_2002_2014 = "http://electionresults.govt.nz/electionresults_{year:d}/e9/csv/e9_part8_{type:s}_{elec_id:d}.csv"
 URL_1999 = "http://electionresults.govt.nz/electionresults_{year:d}/e9/csv/{elec_id:02d}_{elec_name:s}_{type:s}.csv"
 RESULTS_DIR = "results"
+BASE_URL = None # if set, replaces the scheme and host of every URL, e.g. for a local mirror
+
+DEFAULT_JOBS = 4
+DEFAULT_RATE = 2.5 # requests per second, as a courtesy to the server
+RETRIES = 3
+RETRY_BACKOFF = 1.0 # seconds, doubled after each failed attempt
+USER_AGENT = "Elections Analysis"
+
+
+class RateLimiter(object):
+    """Token bucket rate limiter, which can be shared between threads. Each
+    request takes a token; tokens refill at 'rate' per second, up to 'burst'."""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+rate_limiter = RateLimiter()
+
+
+class DownloadSummary(object):
+    """Tallies of what a batch of downloads did."""
+
+    def __init__(self, total):
+        self.total = total
+        self.downloaded = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.failed = []
+        self.changed = [] # (elec_id, vote_type) of each file downloaded
+        self.bytes = 0
+        self.start = time.monotonic()
+
+    @property
+    def done(self):
+        return self.downloaded + self.unchanged + self.skipped + len(self.failed)
+
+    def __str__(self):
+        return "{0:d} files: {1:d} downloaded ({2:,d} bytes), {3:d} unchanged, {4:d} already present, {5:d} failed, in {6:.1f} s".format(
+                self.total, self.downloaded, self.bytes, self.unchanged, self.skipped, len(self.failed), time.monotonic() - self.start)
+
+
+class Manifest(object):
+    """Records, for each downloaded file in a year's directory, where it came
+    from (URL, ETag, Last-Modified) and what was written (size, SHA-256). The
+    manifest is saved as JSON after every update, and is shared between
+    threads."""
+
+    def __init__(self, year):
+        self.filename = os.path.join(RESULTS_DIR, str(year), "manifest.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.filename) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = dict()
+
+    def get(self, filename):
+        with self.lock:
+            return self.entries.get(os.path.basename(filename))
+
+    def update(self, filename, entry):
+        with self.lock:
+            self.entries[os.path.basename(filename)] = entry
+            content = json.dumps(self.entries, indent=2, sort_keys=True).encode()
+            write_atomically(self.filename, content)
+
+_manifests = dict()
+_manifests_lock = threading.Lock()
+
+def get_manifest(year):
+    """Returns the (shared) manifest for this year."""
+    key = os.path.abspath(os.path.join(RESULTS_DIR, str(year)))
+    with _manifests_lock:
+        if key not in _manifests:
+            _manifests[key] = Manifest(year)
+        return _manifests[key]
+
+def file_hash(filename):
+    """Returns the SHA-256 hash of the file's contents, as a hex string."""
+    return hashlib.sha256(archive.read_results(filename)).hexdigest()
+
+_connections = threading.local()
+
+def _get_connection(scheme, netloc):
+    """Returns a keep-alive connection to this host, one per thread."""
+    pool = _connections.__dict__.setdefault("pool", dict())
+    if (scheme, netloc) not in pool:
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        pool[(scheme, netloc)] = cls(netloc, timeout=30)
+    return pool[(scheme, netloc)]
+
+def _drop_connection(scheme, netloc):
+    conn = _connections.__dict__.get("pool", dict()).pop((scheme, netloc), None)
+    if conn is not None:
+        conn.close()
+
+def fetch(url, headers={}, redirects=5, limiter=None):
+    """Fetches the URL over a reused connection, retrying with exponential
+    backoff on connection errors and server errors, and following redirects.
+    Every request, including retries and redirects, takes a token from
+    'limiter' (a RateLimiter) if one is given. Returns a tuple (status,
+    response headers, body)."""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    headers = dict(headers, **{'User-Agent': USER_AGENT})
+
+    for attempt in range(RETRIES + 1):
+        if attempt > 0:
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+        if limiter is not None:
+            limiter.acquire()
+        conn = _get_connection(parts.scheme, parts.netloc)
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            _drop_connection(parts.scheme, parts.netloc)
+            error = e
+            continue
+        if response.will_close:
+            _drop_connection(parts.scheme, parts.netloc)
+        if response.status >= 500:
+            error = IOError("HTTP {0:d} {1:s} from {2:s}".format(response.status, response.reason, url))
+            continue
+        break
+    else:
+        raise error
+
+    if response.status in (301, 302, 303, 307, 308) and redirects > 0:
+        location = urllib.parse.urljoin(url, response.getheader("Location"))
+        return fetch(location, headers, redirects - 1, limiter)
+    if response.status >= 400 or response.status in (301, 302, 303, 307, 308):
+        raise IOError("HTTP {0:d} {1:s} from {2:s}".format(response.status, response.reason, url))
+    return response.status, response.headers, body
+
 
 def check_directories(year):
     """Checks if the directory for this year exists and creates it if it doesn't."""
@@ -30,48 +193,152 @@ def get_filename(year, elec_id, type):
     """Returns the filename for this year and electorate."""
     return os.path.join(RESULTS_DIR, str(year), "electorate_{elec_id:d}_{type:s}.csv".format(elec_id=elec_id, type=type))
 
-def download_all_polling_place_results(year, types=["party"], force=False, quiet=False):
-    """Downloads all CSV files for the year."""
-    for elec_id in range(1, NUM_ELECTORATES[year]+1):
-        for vote_type in types:
-            download_polling_place_results(year, elec_id, vote_type, force, quiet)
+def download_all_polling_place_results(year, types=["party"], force=False, quiet=False, jobs=DEFAULT_JOBS, rate=None, elec_ids=None):
+    """Downloads all CSV files for the year (or just those for 'elec_ids'),
+    using up to 'jobs' concurrent requests. Requests are limited to 'rate' per
+    second across all threads; if 'rate' is None, the module-wide limiter is
+    used. Returns a DownloadSummary, or raises IOError if any download failed."""
+    limiter = rate_limiter if rate is None else RateLimiter(rate)
+    if elec_ids is None:
+        elec_ids = range(1, NUM_ELECTORATES[year]+1)
+    tasks = [(elec_id, vote_type) for elec_id in elec_ids for vote_type in types]
+    summary = DownloadSummary(len(tasks))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_download, year, elec_id, vote_type, force, limiter): (elec_id, vote_type)
+                for elec_id, vote_type in tasks}
+        for future in as_completed(futures):
+            try:
+                filename, status, nbytes = future.result()
+            except OSError as e:
+                summary.failed.append((futures[future], e))
+                message = "failed: electorate {0:d} {1:s}: {2}".format(*futures[future], e)
+            else:
+                if status == "skipped":
+                    summary.skipped += 1
+                    message = "'{0}' already exists, not downloading".format(filename)
+                elif status == "unchanged":
+                    summary.unchanged += 1
+                    message = "'{0}' hasn't changed, not downloading".format(filename)
+                else:
+                    summary.downloaded += 1
+                    summary.changed.append(futures[future])
+                    summary.bytes += nbytes
+                    message = "downloaded '{0}' ({1:,d} bytes)".format(filename, nbytes)
+            if not quiet:
+                print("[{0:d}/{1:d}] {2}".format(summary.done, summary.total, message))
+
+    if not quiet:
+        print(summary)
+    if summary.failed:
+        raise IOError("{0:d} of {1:d} downloads for {2:d} failed".format(len(summary.failed), summary.total, year))
+    return summary
+
+def pack_year(year, remove=True):
+    """Packs the year's results files into a single archive (see archive.py),
+    and removes the separate files unless 'remove' is False. Returns the
+    number of files in the archive."""
+    return archive.pack(os.path.join(RESULTS_DIR, str(year)), remove)
 
 def get_details_file_url(year, elec_id, vote_type):
     if year == 1999:
-        return URL_1999.format(year=year, elec_id=elec_id,
+        url = URL_1999.format(year=year, elec_id=elec_id,
                 elec_name=ELECTORATE_NAMES_1999[elec_id-1], type=vote_type[0])
     elif year >= 2002 and year <= 2014:
-        return URL_2002_2014.format(year=year, elec_id=elec_id, type=vote_type)
+        url = URL_2002_2014.format(year=year, elec_id=elec_id, type=vote_type)
     elif year >= 2017 and year <= 2020:
         if vote_type == "cand":
             vote_type = "candidate"
-        return URL_2017_2020.format(year=year, elec_id=elec_id, type=vote_type)
+        url = URL_2017_2020.format(year=year, elec_id=elec_id, type=vote_type)
+    else:
+        return None
+    return url
+
+def get_fetch_url(url):
+    """Returns the URL to fetch 'url' from, which is on the BASE_URL server if
+    that's set. Manifests always record the original URL."""
+    if BASE_URL:
+        return BASE_URL.rstrip("/") + urllib.parse.urlsplit(url).path
+    return url
+
+def looks_complete(content):
+    """Returns True if 'content' ends with the electorate's total row, as every
+    complete results file does."""
+    lines = content.rstrip().splitlines()
+    return bool(lines) and b" Total," in lines[-1]
 
 def download_polling_place_results(year, elec_id, vote_type="party", force=False, quiet=False):
     """Downloads the CSV file for an electorate and vote type and returns the
     name of the local copy of the file."""
+    filename, status, nbytes = _download(year, elec_id, vote_type, force, rate_limiter)
+    if status == "skipped" and not quiet:
+        print("'{0}' already exists, not downloading".format(filename))
+    elif status == "unchanged" and not quiet:
+        print("'{0}' hasn't changed, not downloading".format(filename))
+    return filename
+
+def _download(year, elec_id, vote_type, force, limiter):
+    """Downloads the CSV file if needed. Returns a tuple (filename, status,
+    nbytes), where 'status' is "downloaded", "unchanged" (the server said the
+    file hasn't changed, or sent the same contents again) or "skipped" (the
+    file wasn't checked).
+
+    A file is trusted if the manifest has a matching entry for it. A file with
+    no entry (e.g. from before manifests were kept) is added to the manifest
+    if it's complete, and downloaded again otherwise, as is a file that
+    doesn't match its entry. With 'force', trusted files are checked using a
+    conditional request."""
     check_directories(year)
     url = get_details_file_url(year, elec_id, vote_type)
     filename = get_filename(year, elec_id, vote_type)
-    if os.path.exists(filename) and not force:
-        if not quiet:
-            print("'{0}' already exists, not downloading".format(filename))
 
-    else:
-        request = urllib.request.Request(url, headers={'User-Agent': 'Elections Analysis'})
-        response = urllib.request.urlopen(request)
-        content = response.read()
-        response.close()
-
-        dirname = os.path.dirname(filename)
-        if dirname:
-            os.makedirs(dirname, exist_ok=True)
-        outfile = open(filename, 'wb')
-        outfile.write(content)
-        outfile.close()
-        time.sleep(0.4)
+    with timings.phase("download-check", (year, elec_id)) as record:
+        manifest = get_manifest(year)
+        entry = manifest.get(filename)
+        stat = archive.results_stat(filename)
+        if entry is None and stat is not None:
+            content = archive.read_results(filename)
+            if looks_complete(content):
+                entry = {"url": url, "etag": None, "last_modified": None, "size": len(content),
+                        "sha256": hashlib.sha256(content).hexdigest()}
+                manifest.update(filename, entry)
+        trusted = entry is not None and entry["url"] == url and stat is not None and stat[0] == entry["size"]
 
-    return filename
+        if trusted and not force:
+            return filename, "skipped", 0
+
+        headers = dict()
+        current = trusted and file_hash(filename) == entry["sha256"]
+        if current:
+            record.bytes += entry["size"]
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+    with timings.phase("download", (year, elec_id)) as record:
+        status, response_headers, content = fetch(get_fetch_url(url), headers, limiter=limiter)
+        record.bytes += len(content)
+        if status == 304:
+            return filename, "unchanged", 0
+
+        # Servers that send neither ETag nor Last-Modified return the whole
+        # file every time, so check whether it's actually changed
+        sha256 = hashlib.sha256(content).hexdigest()
+        if current and sha256 == entry["sha256"]:
+            return filename, "unchanged", len(content)
+
+        write_atomically(filename, content)
+        cache.invalidate(year, elec_id, vote_type)
+        manifest.update(filename, {
+            "url": url,
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+            "size": len(content),
+            "sha256": sha256,
+        })
+
+    return filename, "downloaded", len(content)
 
 if __name__ == "__main__":
     import argparse
@@ -79,10 +346,36 @@ if __name__ == "__main__":
     parser.add_argument("year", type=int)
     parser.add_argument("electorate", nargs="?", type=int, default=None)
     parser.add_argument("type", nargs="?", type=str, choices=["party", "cand"], default="party")
-    parser.add_argument("-f", "--force", action="store_true")
+    parser.add_argument("-f", "--force", action="store_true",
+        help="Check for updated files even if they've already been downloaded")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS,
+        help="Number of concurrent downloads (default %(default)s)")
+    parser.add_argument("-r", "--rate", type=float, default=DEFAULT_RATE,
+        help="Maximum requests per second (default %(default)s)")
+    parser.add_argument("--base-url", type=str, default=None,
+        help="Download from this server instead, e.g. http://localhost:8000")
+    parser.add_argument("-p", "--pack", action="store_true",
+        help="Afterwards, pack the year's files into one archive, results/YEAR.pack")
+    parser.add_argument("-v", "--validate", action="store_true",
+        help="Afterwards, check the year's files for consistency (see validate.py)")
     args = parser.parse_args()
 
+    BASE_URL = args.base_url
+    rate_limiter.rate = args.rate
+
     if args.electorate is None:
-        download_all_polling_place_results(args.year, force=args.force)
+        download_all_polling_place_results(args.year, [args.type], force=args.force, jobs=args.jobs)
     else:
         download_polling_place_results(args.year, args.electorate, args.type, args.force)
+
+    if args.pack:
+        count = pack_year(args.year)
+        print("Packed {0:d} files into '{1}'".format(count, archive.get_archive_filename(os.path.join(RESULTS_DIR, str(args.year)))))
+
+    if args.validate:
+        import download, validate
+        download.BASE_URL = BASE_URL # this script is __main__, not the download module
+        report = validate.validate_year(args.year)
+        validate.print_report(report)
+        if not report["ok"]:
+            sys.exit(1)
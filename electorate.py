@@ -6,16 +6,53 @@ Chuan-Zheng Lee <czlee@stanford.edu>
 November 2014
 """
 
+import archive
+import cache
+import concurrent.futures
 import download
 import csv
+import io
 import itertools
+import numpy
+import re
+import sys
+import timings
+from config import NUM_ELECTORATES
+from parties import registry as party_registry
+
+# Encoding of results files that aren't valid UTF-8, for each year that
+# doesn't use Windows-1252. The 2005 files write the "ā" in "Māori" as the
+# single byte 0xE2, which is "ā" in ISO-8859-13 (but "â" in Windows-1252).
+YEAR_ENCODINGS = {
+    2005: "iso8859-13",
+}
+DEFAULT_ENCODING = "cp1252"
+
+def get_encodings(year):
+    """Returns the encodings to try for a results file from this year, in
+    order: UTF-8, then the year's encoding, then Latin-1, which decodes
+    anything."""
+    return ["utf-8-sig", YEAR_ENCODINGS.get(year, DEFAULT_ENCODING), "latin-1"]
+
+def decode_results(data, year=None):
+    """Decodes the contents of a results file (bytes), and returns it as text
+    with universal newlines."""
+    for encoding in get_encodings(year):
+        try:
+            text = data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
 
 class VoteCounts(object):
-    """Vote counts for each party."""
+    """Vote counts for each party, stored as an int64 vector over parties."""
+
+    __slots__ = ("stats", "_votes")
 
     def __init__(self, stats, votes):
         self.stats = stats
-        self._votes = votes
+        self._votes = numpy.asarray(votes, dtype=numpy.int64)
 
     @property
     def parties(self):
@@ -23,50 +60,142 @@ class VoteCounts(object):
 
     @property
     def votes(self):
-        return dict(zip(self.parties, self._votes))
+        return dict(zip(self.parties, self._votes.tolist()))
+
+    def _fractions(self):
+        total_votes = self._votes.sum() or 0.1
+        return self._votes / total_votes
 
     @property
     def percentages(self):
-        total_votes = sum(self._votes) or 0.1
-        percentages = [float(votes)/total_votes for votes in self._votes]
-        return dict(zip(self.parties, percentages))
+        return dict(zip(self.parties, self._fractions().tolist()))
 
     def iter_votes(self):
-        return zip(self.parties, self._votes)
+        return zip(self.parties, self._votes.tolist())
 
     def iter_percentages(self):
-        total_votes = sum(self._votes) or 0.1
-        for party, votes in self.iter_votes():
-            yield party, float(votes)/total_votes
+        return zip(self.parties, self._fractions().tolist())
 
     def __add__(self, other):
         """Add votes party-by-party"""
         assert(isinstance(other, VoteCounts))
         assert(self.parties == other.parties)
-        votes = list(map(sum, list(zip(self._votes, other._votes))))
-        return VoteCounts(self.stats, votes)
+        return VoteCounts(self.stats, self._votes + other._votes)
+
+    def __sub__(self, other):
+        """Subtract votes party-by-party"""
+        assert(isinstance(other, VoteCounts))
+        assert(self.parties == other.parties)
+        return VoteCounts(self.stats, self._votes - other._votes)
 
     def __eq__(self, other):
-        return self.parties == other.parties and self._votes == other._votes
+        return self.parties == other.parties and numpy.array_equal(self._votes, other._votes)
 
     def __ne__(self, other):
-        return self.parties != other.parties or self._votes != other._votes
+        return not self == other
 
     @staticmethod
     def blank(stats):
-        return VoteCounts(stats, [0] * len(stats.parties))
+        return VoteCounts(stats, numpy.zeros(len(stats.parties), dtype=numpy.int64))
 
 class PollingPlaceResults(VoteCounts):
-    """Vote counts for a particular polling place."""
+    """Vote counts for a particular polling place. Polling places from results
+    files are lightweight views of one row of a PollingPlaceTable."""
+
+    __slots__ = ("table", "index")
 
     def __init__(self, electorate, id_no, suburb, location, votes):
-        """'suburb' and 'name' are strings.
-        'votes' is a list. Information about parties is not stored here, it's
-        just kept in 'electorate'."""
-        VoteCounts.__init__(self, electorate, votes)
-        self.id = id_no
-        self.suburb = suburb
-        self.location = location
+        """'suburb' and 'location' are strings. 'votes' is a list. Information
+        about parties is not stored here, it's just kept in 'electorate'. The
+        polling place is put in a table of its own."""
+        table = PollingPlaceTable(electorate, ids=[id_no], suburbs=[0], locations=[1],
+                strings=[suburb, location], votes=[votes])
+        VoteCounts.__init__(self, electorate, table.votes[0])
+        self.table = table
+        self.index = 0
+
+    @classmethod
+    def from_table(cls, table, index):
+        """Returns a view of row 'index' of a PollingPlaceTable."""
+        self = cls.__new__(cls)
+        VoteCounts.__init__(self, table.stats, table.votes[index])
+        self.table = table
+        self.index = index
+        return self
+
+    @property
+    def id(self):
+        return int(self.table.ids[self.index])
+
+    @property
+    def suburb(self):
+        return self.table.strings[self.table.suburbs[self.index]]
+
+    @property
+    def location(self):
+        return self.table.strings[self.table.locations[self.index]]
+
+
+class PollingPlaceTable(object):
+    """Results for a list of polling places, stored column-wise: 'votes' is a
+    (polling place x party) int64 array, 'ids' holds the row numbers in the
+    results file, and 'suburbs' and 'locations' are indices into 'strings'.
+    Indexing or iterating over the table gives PollingPlaceResults views, and
+    slicing gives a list of them."""
+
+    __slots__ = ("stats", "ids", "suburbs", "locations", "strings", "votes")
+
+    def __init__(self, stats, ids, suburbs, locations, strings, votes):
+        self.stats = stats
+        self.ids = numpy.asarray(ids, dtype=numpy.int32)
+        self.suburbs = numpy.asarray(suburbs, dtype=numpy.int32)
+        self.locations = numpy.asarray(locations, dtype=numpy.int32)
+        self.strings = [sys.intern(string) if isinstance(string, str) else string for string in strings]
+        self.votes = numpy.asarray(votes, dtype=numpy.int64).reshape(len(self.ids), len(stats.parties))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [PollingPlaceResults.from_table(self, i) for i in range(*index.indices(len(self)))]
+        if not -len(self) <= index < len(self):
+            raise IndexError("polling place index out of range")
+        return PollingPlaceResults.from_table(self, index % len(self))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield PollingPlaceResults.from_table(self, index)
+
+    def sum(self):
+        """Returns the total votes over all polling places."""
+        return VoteCounts(self.stats, self.votes.sum(axis=0))
+
+    def columns(self):
+        """Returns the columns as a dict, as used in snapshots."""
+        return {"ids": self.ids, "suburbs": self.suburbs, "locations": self.locations,
+                "strings": self.strings, "votes": self.votes}
+
+
+class derived_category(object):
+    """Decorator for a vote category derived from other fields. It works like a
+    read-only property, except that the value is computed once and kept until
+    one of the fields it depends on is reassigned."""
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        derived = obj.__dict__.setdefault("_derived", dict())
+        try:
+            return derived[self.name]
+        except KeyError:
+            value = derived[self.name] = self.func(obj)
+            return value
 
 
 class GeneralStatistics(object):
@@ -75,6 +204,9 @@ class GeneralStatistics(object):
     BASIC_FIELDS = ["ordinary_polling_places", "ordinary_advance", "special_advance",
         "less_than_6", "special_on", "overseas", "party_only", "totals"]
 
+    # Reassigning any of these discards all derived categories
+    DEPENDENT_FIELDS = frozenset(BASIC_FIELDS + ["parties"])
+
     def __init__(self, parties, **kwargs):
         self.parties = parties
         for key in self.BASIC_FIELDS:
@@ -88,39 +220,63 @@ class GeneralStatistics(object):
             else:
                 raise TypeError("__init__() got an unexpected keyword argument '{0!r}'".format(key))
 
-    @property
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.DEPENDENT_FIELDS:
+            self.__dict__.pop("_derived", None)
+
+    @derived_category
     def ordinary(self):
         """All ordinary votes."""
         return self.ordinary_polling_places + self.ordinary_advance
 
-    @property
+    @derived_category
     def advance(self):
         """All advance votes."""
         return self.ordinary_advance + self.special_advance
 
-    @property
+    @derived_category
     def specials(self):
         """All special votes."""
         return self.special_advance + self.special_on + self.overseas + self.party_only
 
-    @property
+    @derived_category
     def specials_domestic(self):
         """Special votes except overseas votes."""
         return self.special_advance + self.special_on + self.party_only
 
-    @property
+    @derived_category
     def domestic(self):
         """All domestic votes."""
         return self.ordinary + self.specials_domestic
 
+    @derived_category
+    def party_ids(self):
+        """IDs of 'parties' in the party registry (see parties.py), an int array."""
+        return party_registry.ids(self.parties)
+
+    def as_array(self):
+        """Returns the basic fields as a (field x party) int64 array, with rows
+        in the order of BASIC_FIELDS."""
+        return numpy.array([getattr(self, field)._votes for field in self.BASIC_FIELDS], dtype=numpy.int64)
+
+    @classmethod
+    def from_array(cls, parties, array):
+        """Builds a GeneralStatistics from an array returned by as_array()."""
+        result = GeneralStatistics(parties)
+        for field, votes in zip(cls.BASIC_FIELDS, array):
+            setattr(result, field, VoteCounts(result, votes))
+        return result
+
     def __add__(self, other):
         """Add vote counts field-wise."""
         assert(self.parties == other.parties)
-        kwargs = dict()
-        for field in self.BASIC_FIELDS:
-            kwargs[field] = getattr(self, field) + getattr(other, field)
-        result = GeneralStatistics(self.parties, **kwargs)
-        return result
+        return GeneralStatistics.from_array(self.parties, self.as_array() + other.as_array())
+
+    def __sub__(self, other):
+        """Subtract vote counts field-wise."""
+        assert(self.parties == other.parties)
+        return GeneralStatistics.from_array(self.parties, self.as_array() - other.as_array())
 
 
 class ElectorateStatistics(GeneralStatistics):
@@ -139,38 +295,271 @@ class ElectorateStatistics(GeneralStatistics):
 
     SPECIAL_FIELDS = list(set(SPECIAL_ROW_NAMES.values())) + ["totals"]
 
-    def __init__(self, year, electorate, init=True):
+    # Matches a lower-cased row label that starts with a special row name,
+    # optionally followed by " - " and a note; longer names are tried first
+    SPECIAL_ROW_PATTERN = re.compile(r"\s*(" + "|".join(re.escape(name) for name in
+            sorted(SPECIAL_ROW_NAMES, key=len, reverse=True)) + r")\s*(?:-|\Z)")
+
+    # Vote counts, joined by commas, that the fast parser converts itself
+    COUNTS_PATTERN = re.compile(r"(?:[0-9]+(?:,[0-9]+)*)?\Z")
+
+    DEPENDENT_FIELDS = GeneralStatistics.DEPENDENT_FIELDS | {"pprs", "polling_place_sum"}
+
+    # Set to False to skip the totals check after each file is loaded, e.g.
+    # if validate.py has already checked the year
+    check_totals = True
+
+    # Set to False to always parse with the csv module, which is slower but
+    # handles anything the fast parser gives up on
+    fast_parse = True
+
+    # Bytes read from the start of a results file for its header, which is
+    # enough for even a long list of candidates
+    HEADER_BYTES = 16384
+
+    # Attributes that a lazily-loaded object parses the file for
+    LAZY_FIELDS = frozenset(SPECIAL_FIELDS + ["pprs", "polling_place_sum"])
+
+    def __init__(self, year, electorate, init=True, use_cache=True, keep_polling_places=True,
+            vote_type="party", candidates=False, lazy=False):
+        """'vote_type' is "party" or "cand". For candidate votes, 'parties' are
+        the candidates' names, and 'affiliations' their parties. If
+        'candidates' is True, the candidate votes for the electorate are also
+        loaded into 'candidates'. If 'lazy' is True, only the header of the
+        file is read, and the rest is parsed when vote counts are first used."""
         # don't call parent constructor
         self.year = year
         self.electorate = electorate
+        self.use_cache = use_cache
+        self.keep_polling_places = keep_polling_places
+        self.vote_type = vote_type
 
         if init:
             self.download_files()
-            self.parse_party_file()
+            if lazy:
+                self.load_header()
+            else:
+                self.parse_file()
+            if candidates:
+                self.load_candidates(lazy)
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set, i.e. before a lazy load
+        if name in self.LAZY_FIELDS and self.__dict__.pop("_pending", False):
+            self.parse_file()
+            return getattr(self, name)
+        raise AttributeError("{0!r} object has no attribute {1!r}".format(type(self).__name__, name))
 
     def _warn(self, message):
-        print("Warning: [{0:d}, {1:d}] {2:s}".format(self.year, self.electorate, message))
+        print("Warning: [{0:d}, {1:d}] {2:s}".format(self.year, self.electorate, message), file=sys.stderr)
 
     def download_files(self):
-        self.filename_party = download.download_polling_place_results(self.year, self.electorate, vote_type="party", quiet=True)
+        self.filename = download.download_polling_place_results(self.year, self.electorate, vote_type=self.vote_type, quiet=True)
+
+    def parse_file(self):
+        """Parses the results file, or loads its snapshot from the cache if the
+        file hasn't changed since it was last parsed."""
+        self.load_snapshot(self.get_snapshot())
+
+    def get_snapshot(self):
+        """Returns a snapshot of the results file, from the cache if possible."""
+        if not self.use_cache:
+            return self.read_file(self.keep_polling_places)
+        key = cache.fingerprint(self.filename)
+        snapshot = cache.load(self.year, self.electorate, self.vote_type, key)
+        if snapshot is None:
+            snapshot = self.read_file()
+            cache.store(self.year, self.electorate, self.vote_type, key, snapshot)
+        return snapshot
+
+    def read_header(self):
+        """Reads only the header lines of the results file, and returns a dict
+        with its "parties", "affiliations", "name" and "id". The header is
+        taken from the cached snapshot if it's up to date, and otherwise from
+        the first HEADER_BYTES of the file."""
+        if self.use_cache:
+            snapshot = cache.load(self.year, self.electorate, self.vote_type, cache.fingerprint(self.filename))
+            if snapshot is not None:
+                return {key: snapshot[key] for key in ("parties", "affiliations", "name", "id")}
+        data = archive.read_results(self.filename, self.HEADER_BYTES)
+        whole = len(data) < self.HEADER_BYTES
+        if not whole:
+            data = data[:data.rfind(b"\n")+1] # only whole lines
+        lines = decode_results(data, self.year).split("\n")
+        reader = csv.reader(lines)
+        try:
+            header = self._read_header(reader)[0]
+        except (StopIteration, ValueError, IndexError):
+            if whole:
+                raise
+        else:
+            if whole or reader.line_num < len(lines) - 1: # didn't run out of lines
+                return header
+
+        # The header is longer than HEADER_BYTES
+        rows = self.iter_file()
+        try:
+            return next(rows)
+        finally:
+            rows.close()
+
+    def load_header(self):
+        """Sets 'parties', 'affiliations', 'name' and 'id' from the header of
+        the results file, and leaves the vote counts to be parsed when they're
+        first used."""
+        header = self.read_header()
+        self.parties, self.affiliations, self.name, self.id = header["parties"], header["affiliations"], header["name"], header["id"]
+        self._pending = True
+
+    def read_file(self, keep_polling_places=True):
+        """Parses the results file and returns a snapshot of its contents, as a
+        dict of plain Python objects. Special rows and polling places are
+        summed as they're read. If 'keep_polling_places' is False, the rows
+        for individual polling places aren't kept, and "pprs" is None."""
+        with timings.phase("parse", (self.year, self.electorate)) as record:
+            if timings.enabled:
+                record.bytes += archive.results_stat(self.filename)[0]
+            return self._read_file(keep_polling_places)
+
+    def _read_file(self, keep_polling_places):
+        if self.fast_parse:
+            snapshot = self._read_file_fast(keep_polling_places)
+            if snapshot is not None:
+                return snapshot
+
+        rows = self.iter_file()
+        snapshot = next(rows)
+        nparties = len(snapshot["parties"])
+        special = dict()
+        polling_places = [0] * nparties
+        strings = dict() # string -> index into strings, in order of appearance
+        ids, suburbs, locations, pp_votes = [], [], [], []
+
+        for field, num, suburb, location, votes in rows:
+            if field is None:
+                polling_places = list(map(sum, zip(polling_places, votes)))
+                if keep_polling_places:
+                    ids.append(num)
+                    suburbs.append(strings.setdefault(suburb, len(strings)))
+                    locations.append(strings.setdefault(location, len(strings)))
+                    pp_votes.append(votes)
+            else:
+                existing = special.get(field, [0] * nparties)
+                special[field] = list(map(sum, zip(existing, votes)))
+
+        if keep_polling_places:
+            pprs = {
+                "ids": numpy.array(ids, dtype=numpy.int32),
+                "suburbs": numpy.array(suburbs, dtype=numpy.int32),
+                "locations": numpy.array(locations, dtype=numpy.int32),
+                "strings": list(strings),
+                "votes": numpy.array(pp_votes, dtype=numpy.int64).reshape(len(ids), nparties),
+            }
+        else:
+            pprs = None
+
+        snapshot.update({"special": special, "pprs": pprs, "polling_places": polling_places})
+        return snapshot
+
+    def _read_file_fast(self, keep_polling_places):
+        """Does the same as the csv-based path in _read_file(), but splits
+        lines itself and converts all the vote counts in one go. Returns None
+        if the file has something this doesn't handle (a quoted line break, a
+        row with the wrong number of columns, or a count that isn't an
+        integer), so that the csv-based path can be used instead."""
+        lines = iter(self.read_text().split("\n"))
+        try:
+            snapshot, end_columns, pending = self._read_header(csv.reader(lines))
+        except (StopIteration, ValueError, IndexError):
+            return None # let the csv-based path raise the error
+        nparties = len(snapshot["parties"])
+        totals_pattern = re.compile(r"\s*" + re.escape(snapshot["name"].lower()) + r"\s+total\s*\Z")
+
+        special_rows = dict() # field -> row indices, in order of appearance
+        pp_rows = []
+        strings = dict() # string -> index into strings, in order of appearance
+        ids, suburbs, locations, cells = [], [], [], []
+        suburb = None
+        for num, line in enumerate(itertools.chain(pending, lines), start=1):
+            if isinstance(line, str):
+                if '"' not in line:
+                    line = line.split(",")
+                elif line.count('"') % 2 == 0:
+                    line = next(csv.reader([line]))
+                else:
+                    return None
+
+            if not any(line) or not any(line[2:]): # skip blank lines and lines without vote counts
+                continue
 
-    def parse_party_file(self):
-        csvfile = open(self.filename_party)
-        reader = csv.reader(csvfile)
+            suburb = line[0] or suburb
+            location = line[1]
+            votes = line[2:len(line)-end_columns]
+            if len(votes) == 0:
+                votes = ["0"] * nparties
+            elif len(votes) != nparties:
+                return None
+            row = len(cells)
+            cells.append(",".join(votes))
+
+            label = location.lower()
+            if totals_pattern.match(label):
+                special_rows["totals"] = [row]
+                break # assume totals link is always last
 
+            match = self.SPECIAL_ROW_PATTERN.match(label)
+            if match:
+                special_rows.setdefault(self.SPECIAL_ROW_NAMES[match.group(1)], []).append(row)
+            else:
+                pp_rows.append(row)
+                if keep_polling_places:
+                    ids.append(num)
+                    suburbs.append(strings.setdefault(suburb, len(strings)))
+                    locations.append(strings.setdefault(location, len(strings)))
+
+        # Convert all the counts at once; anything but plain digits is left to
+        # the csv-based path, so that both paths accept the same files
+        text = ",".join(cells)
+        if not self.COUNTS_PATTERN.match(text):
+            return None
+        votes = numpy.fromstring(text, dtype=numpy.int64, sep=",") if text else numpy.zeros(0, dtype=numpy.int64)
+        votes = votes.reshape(len(cells), nparties)
+
+        special = {field: votes[rows].sum(axis=0).tolist() for field, rows in special_rows.items()}
+        if keep_polling_places:
+            pprs = {
+                "ids": numpy.array(ids, dtype=numpy.int32),
+                "suburbs": numpy.array(suburbs, dtype=numpy.int32),
+                "locations": numpy.array(locations, dtype=numpy.int32),
+                "strings": list(strings),
+                "votes": votes[pp_rows],
+            }
+        else:
+            pprs = None
+
+        snapshot.update({"special": special, "pprs": pprs, "polling_places": votes[pp_rows].sum(axis=0).tolist()})
+        return snapshot
+
+    def read_text(self):
+        """Returns the contents of the results file as text, decoded with
+        the first of get_encodings() that works for it."""
+        return decode_results(archive.read_results(self.filename), self.year)
+
+    def _read_header(self, reader):
+        """Reads the header lines from 'reader', a csv.reader, and returns a
+        tuple (header, end_columns, pending), where 'header' is the dict that
+        iter_file() yields first, 'end_columns' is the number of columns after
+        the vote counts and 'pending' is a list of rows that were read but are
+        still to be parsed."""
         if self.year == 1999:
             # Electorate name and party column headings
             line = next(reader)
             name, elec_id = line[0].rsplit(None, 4)[0:2]
             name = name.title()
-            END_COLUMNS = 4
+            end_columns = 4
 
         else:
-            try:
-                next(reader) # Header line
-            except:
-                print(self.filename_party)
-                raise
+            next(reader) # Header line
 
             # Electorate name line
             line = next(reader)
@@ -179,16 +568,41 @@ class ElectorateStatistics(GeneralStatistics):
             # Party column headings
             # First two columns are polling place names, last two are totals
             line = next(reader)
-            END_COLUMNS = 2
-
-        self.parties = [party for party in line[2:len(line)-END_COLUMNS]]
-        self.name = name
-        self.id = int(elec_id)
+            end_columns = 2
+
+        parties = [party for party in line[2:len(line)-end_columns]]
+
+        # Candidate files have a row of party affiliations under the
+        # candidate names; polling place rows have numbers there
+        affiliations = None
+        line = next(reader, [])
+        pending = [line]
+        cells = [cell.strip() for cell in line[2:len(line)-end_columns]]
+        if any(cells) and not all(cell.isdigit() or not cell for cell in cells):
+            affiliations = [cell or None for cell in cells]
+            pending = []
+
+        header = {"parties": parties, "affiliations": affiliations, "name": name, "id": int(elec_id)}
+        return header, end_columns, pending
+
+    def iter_file(self):
+        """Parses the results file one row at a time. The first item yielded is
+        a dict with the electorate's "parties", "affiliations", "name" and "id".
+        Each item after that is a tuple (field, num, suburb, location, votes), where 'field' is
+        the special field that the row counts towards, or None for a polling
+        place. The totals row, if there is one, is the last item."""
+        reader = csv.reader(io.StringIO(self.read_text()))
+        try:
+            header, end_columns, lines = self._read_header(reader)
+        except:
+            print(self.filename)
+            raise
+        parties, name = header["parties"], header["name"]
+        yield header
 
         # Polling places
-        self.pprs = list()
         suburb = None
-        for num, line in enumerate(reader, start=1):
+        for num, line in enumerate(itertools.chain(lines, reader), start=1):
 
             if not any(line): # skip blank lines
                 continue
@@ -197,47 +611,280 @@ class ElectorateStatistics(GeneralStatistics):
 
             suburb = line[0] or suburb
             location = line[1]
-            votes = list(map(int, line[2:len(line)-END_COLUMNS]))
+            votes = list(map(int, line[2:len(line)-end_columns]))
             if len(votes) == 0:
-                votes = [0] * len(self.parties)
+                votes = [0] * len(parties)
 
-            if location.lower().strip().rsplit(None, 1) == [self.name.lower(), "total"]:
-                self.totals = VoteCounts(self, votes)
+            if location.lower().strip().rsplit(None, 1) == [name.lower(), "total"]:
+                yield "totals", num, suburb, location, votes
                 break # assume totals link is always last
 
             elif location.lower().split("-")[0].strip() in self.SPECIAL_ROW_NAMES:
-                row_label = location.lower().split("-")[0].strip()
-                existing = getattr(self, self.SPECIAL_ROW_NAMES[row_label], VoteCounts.blank(self))
-                this_row = VoteCounts(self, votes)
-                setattr(self, self.SPECIAL_ROW_NAMES[row_label], existing + this_row)
+                field = self.SPECIAL_ROW_NAMES[location.lower().split("-")[0].strip()]
+                yield field, num, suburb, location, votes
 
             else:
-                ppr = PollingPlaceResults(self, num, suburb, location, votes)
-                self.pprs.append(ppr)
+                yield None, num, suburb, location, votes
+
+    def load_snapshot(self, snapshot):
+        """Populates this object from a snapshot returned by read_file().
+        Polling places are kept in a PollingPlaceTable, but only if both the
+        snapshot has them and 'keep_polling_places' is set; otherwise 'pprs' is
+        None, and only their sum is kept."""
+        with timings.phase("build", (self.year, self.electorate)):
+            self._load_snapshot(snapshot)
+
+    def _load_snapshot(self, snapshot):
+        self.parties = snapshot["parties"]
+        self.affiliations = snapshot["affiliations"]
+        self.name = snapshot["name"]
+        self.id = snapshot["id"]
+        if self.keep_polling_places and snapshot["pprs"] is not None:
+            self.pprs = PollingPlaceTable(self, **snapshot["pprs"])
+        else:
+            self.pprs = None
+            self.polling_place_sum = VoteCounts(self, snapshot["polling_places"])
+        for field, votes in snapshot["special"].items():
+            setattr(self, field, VoteCounts(self, votes))
 
         if self.year == 1999: # 1999 doesn't have these figures
             self.less_than_6 = VoteCounts.blank(self)
             self.party_only = VoteCounts.blank(self)
+        if self.vote_type == "cand" and not hasattr(self, "party_only"):
+            self.party_only = VoteCounts.blank(self) # not applicable to candidate votes
 
         # Check we filled all the special row cases
-        for name in self.SPECIAL_FIELDS:
-            if not hasattr(self, name):
-                self._warn("No row found for {0!r}".format(name))
-                setattr(self, name, VoteCounts(self, [0] * len(self.parties)))
+        self.missing_rows = [name for name in self.SPECIAL_FIELDS if not hasattr(self, name)]
+        for name in self.missing_rows:
+            self._warn("No row found for {0!r}".format(name))
+            setattr(self, name, VoteCounts.blank(self))
 
         # Sanity check
-        if self.ordinary + self.specials != self.totals:
-            self._warn("Totals don't match")
-            print((self.ordinary + self.specials).votes)
-            print(self.totals.votes)
-
-        csvfile.close()
-
-    @property
+        if self.check_totals:
+            total = self.ordinary + self.specials
+            if total != self.totals:
+                self._warn("Totals don't match")
+                print(total.votes, file=sys.stderr)
+                print(self.totals.votes, file=sys.stderr)
+
+    @derived_category
     def ordinary_polling_places(self):
         """All ordinary votes at polling places."""
-        return sum(self.pprs, self.less_than_6)
+        if self.pprs is None:
+            return self.polling_place_sum + self.less_than_6
+        return self.pprs.sum() + self.less_than_6
+
+    def load_candidates(self, lazy=False):
+        """Loads the candidate votes for this electorate into 'candidates', an
+        ElectorateStatistics whose 'parties' are the candidates."""
+        self.candidates = ElectorateStatistics(self.year, self.electorate, use_cache=self.use_cache,
+                keep_polling_places=self.keep_polling_places, vote_type="cand", lazy=lazy)
+
+    def candidate_party_matrix(self):
+        """Returns a (candidate x party) 0/1 matrix, with a 1 where the
+        candidate is affiliated with the party. Multiplying candidate votes by
+        it gives each party's candidate votes in party columns."""
+        affiliations = self.candidates.affiliations
+        if affiliations is None:
+            raise ValueError("Candidate file for {0:d} electorate {1:d} has no party affiliations".format(self.year, self.electorate))
+        return numpy.array([[affiliation == party for party in self.parties] for affiliation in affiliations], dtype=numpy.int64)
+
+    def candidate_polling_place_rows(self):
+        """Returns an array giving, for each row of 'pprs', the row of
+        'candidates.pprs' for the same polling place, or -1 if it has none.
+        Polling places are matched by suburb and location."""
+        rows = dict()
+        for index, ppr in enumerate(self.candidates.pprs):
+            rows.setdefault((ppr.suburb, ppr.location), []).append(index)
+        for indices in rows.values():
+            indices.reverse()
+        return numpy.array([(rows.get((ppr.suburb, ppr.location)) or [-1]).pop() for ppr in self.pprs], dtype=numpy.int64)
+
+    def compare_candidate_votes(self):
+        """Returns a dict of arrays comparing each party's votes with the votes
+        for its electorate candidate, all with party columns:
+            "party_fields", "candidate_fields": (field x party), by BASIC_FIELDS
+            "party_booths", "candidate_booths": (polling place x party), in the
+                order of 'pprs'
+        Parties without a candidate get zero candidate votes."""
+        if self.pprs is None or self.candidates.pprs is None:
+            raise ValueError("Polling places weren't kept for {0:d} electorate {1:d}".format(self.year, self.electorate))
+        matrix = self.candidate_party_matrix()
+        rows = self.candidate_polling_place_rows()
+        candidate_votes = numpy.vstack([self.candidates.pprs.votes, numpy.zeros((1, len(matrix)), dtype=numpy.int64)])
+        return {
+            "party_fields": self.as_array(),
+            "candidate_fields": self.candidates.as_array() @ matrix,
+            "party_booths": self.pprs.votes,
+            "candidate_booths": candidate_votes[rows] @ matrix,
+        }
+
+
+
+class NationalStatistics(GeneralStatistics):
+    """Statistics for a whole election, summed over all electorates. The
+    statistics for each electorate are kept in 'electorates', a dict keyed by
+    electorate number."""
+
+    def __init__(self, year, init=True, jobs=1, keep_polling_places=True, candidates=False):
+        # don't call parent constructor
+        self.year = year
+        self.electorates = dict()
 
+        if init:
+            self.load_electorates(jobs, keep_polling_places, candidates)
+
+    def load_electorates(self, jobs=1, keep_polling_places=True, candidates=False):
+        keys = [(self.year, elec_id) for elec_id in range(1, NUM_ELECTORATES[self.year]+1)]
+        self.set_electorates(load_electorates(keys, jobs, keep_polling_places, candidates).values())
+
+    def set_electorates(self, electorates):
+        """Sets the electorates and recomputes the national totals. All
+        electorates are summed in a single pass over an (electorate x field x
+        party) array, which is kept in 'array'."""
+        with timings.phase("aggregate", self.year):
+            self._set_electorates(list(electorates))
+
+    def _set_electorates(self, electorates):
+        parties = electorates[0].parties
+        for es in electorates:
+            if es.parties != parties:
+                raise ValueError("Electorate {0:d} has different parties from electorate {1:d}".format(es.electorate, electorates[0].electorate))
+
+        self.electorates = {es.electorate: es for es in electorates}
+        self._rows = {es.electorate: row for row, es in enumerate(electorates)}
+        self.array = numpy.stack([es.as_array() for es in electorates])
+        self.parties = parties
+        for field, votes in zip(self.BASIC_FIELDS, self.array.sum(axis=0)):
+            setattr(self, field, VoteCounts(self, votes))
+
+    def update_electorates(self, electorates):
+        """Replaces some of the electorates with new ElectorateStatistics for
+        them, and updates the national totals by subtracting the old
+        electorates' contributions and adding the new ones, without summing
+        the others again. Returns the change in the totals, as a
+        GeneralStatistics."""
+        with timings.phase("aggregate", self.year):
+            delta = numpy.zeros_like(self.array[0])
+            for es in electorates:
+                if es.parties != self.parties:
+                    raise ValueError("Electorate {0:d} has different parties from the national totals".format(es.electorate))
+                row = self._rows[es.electorate]
+                new = es.as_array()
+                delta += new - self.array[row]
+                self.array[row] = new
+                self.electorates[es.electorate] = es
+            for field, votes in zip(self.BASIC_FIELDS, self.as_array() + delta):
+                setattr(self, field, VoteCounts(self, votes))
+        return GeneralStatistics.from_array(self.parties, delta)
+
+    def compare_candidate_votes(self):
+        """Like ElectorateStatistics.compare_candidate_votes(), but over all
+        electorates: fields are summed, and polling places from all
+        electorates are stacked in electorate order."""
+        comparisons = [self.electorates[elec_id].compare_candidate_votes() for elec_id in sorted(self.electorates)]
+        return {
+            "party_fields": sum(c["party_fields"] for c in comparisons),
+            "candidate_fields": sum(c["candidate_fields"] for c in comparisons),
+            "party_booths": numpy.vstack([c["party_booths"] for c in comparisons]),
+            "candidate_booths": numpy.vstack([c["candidate_booths"] for c in comparisons]),
+        }
+
+
+
+def iter_polling_places(year, elec_id):
+    """Yields the PollingPlaceResults for each polling place in an electorate
+    as it's parsed, without keeping them. Their 'stats' is an
+    ElectorateStatistics with only 'parties', 'name' and 'id' filled in."""
+    es = ElectorateStatistics(year, elec_id, init=False)
+    es.download_files()
+    rows = es.iter_file()
+    header = next(rows)
+    es.parties, es.affiliations, es.name, es.id = header["parties"], header["affiliations"], header["name"], header["id"]
+    for field, num, suburb, location, votes in rows:
+        if field is None:
+            yield PollingPlaceResults(es, num, suburb, location, votes)
+
+def electorate_directory(year, use_cache=True):
+    """Returns a dict mapping each electorate number in the year to a dict with
+    its "name", "id" and "parties". Only the headers of the results files are
+    read, and the directory is cached until any of the files changes."""
+    download.download_all_polling_place_results(year, ["party"], quiet=True)
+    sources = {elec_id: download.get_filename(year, elec_id, "party") for elec_id in range(1, NUM_ELECTORATES[year]+1)}
+    keys = cache.fingerprints(sources) if use_cache else None
+    directory = cache.load_directory(year, keys) if use_cache else None
+    if directory is None:
+        directory = dict()
+        for elec_id, filename in sources.items():
+            es = ElectorateStatistics(year, elec_id, init=False, use_cache=use_cache)
+            es.filename = filename
+            header = es.read_header()
+            directory[elec_id] = {"name": header["name"], "id": header["id"], "parties": header["parties"]}
+        if use_cache:
+            cache.store_directory(year, keys, directory)
+    return directory
+
+def _read_snapshot(key, keep_polling_places=True, vote_types=("party",)):
+    """Worker for load_electorates(). Returns the key, a dict of its snapshots
+    by vote type (which are small and cheap to pickle back to the parent
+    process) and any timings recorded while getting them."""
+    year, elec_id = key
+    snapshots = dict()
+    for vote_type in vote_types:
+        es = ElectorateStatistics(year, elec_id, init=False, keep_polling_places=keep_polling_places, vote_type=vote_type)
+        es.filename = download.get_filename(year, elec_id, vote_type)
+        snapshots[vote_type] = es.get_snapshot()
+        if not keep_polling_places:
+            snapshots[vote_type] = dict(snapshots[vote_type], pprs=None)
+    return key, snapshots, timings.drain()
+
+def load_electorates(keys, jobs=1, keep_polling_places=True, candidates=False):
+    """Loads the ElectorateStatistics for every (year, electorate) pair in
+    'keys', and returns them in a dict keyed by those pairs. Missing files are
+    downloaded first. Files are then parsed in up to 'jobs' worker processes
+    (all available cores if 'jobs' is None), and the results are assembled in
+    this process. If 'keep_polling_places' is False, only the sum of each
+    electorate's polling places is kept. If 'candidates' is True, candidate
+    votes are loaded too, in the same pass."""
+    keys = list(keys)
+    vote_types = ("party", "cand") if candidates else ("party",)
+    for year in sorted(set(year for year, elec_id in keys)):
+        elec_ids = [elec_id for y, elec_id in keys if y == year]
+        download.download_all_polling_place_results(year, vote_types, quiet=True, elec_ids=elec_ids)
+
+    args = (keys, itertools.repeat(keep_polling_places), itertools.repeat(vote_types))
+    if jobs == 1:
+        snapshots = map(_read_snapshot, *args)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs, initializer=timings.reset, initargs=(timings.enabled,))
+        snapshots = executor.map(_read_snapshot, *args, chunksize=4)
+
+    electorates = dict()
+    for (year, elec_id), snapshots_by_type, records in snapshots:
+        timings.merge(records)
+        for vote_type in vote_types:
+            es = ElectorateStatistics(year, elec_id, init=False, keep_polling_places=keep_polling_places, vote_type=vote_type)
+            es.filename = download.get_filename(year, elec_id, vote_type)
+            es.load_snapshot(snapshots_by_type[vote_type])
+            if vote_type == "party":
+                electorates[(year, elec_id)] = es
+            else:
+                electorates[(year, elec_id)].candidates = es
+
+    if jobs != 1:
+        executor.shutdown()
+    return electorates
+
+def load_years(years, jobs=1, keep_polling_places=True, candidates=False):
+    """Returns a dict mapping each year to its NationalStatistics. Every
+    electorate of every year is parsed in one pool of up to 'jobs' processes."""
+    keys = [(year, elec_id) for year in years for elec_id in range(1, NUM_ELECTORATES[year]+1)]
+    electorates = load_electorates(keys, jobs, keep_polling_places, candidates)
+    result = dict()
+    for year in years:
+        result[year] = NationalStatistics(year, init=False)
+        result[year].set_electorates(electorates[(year, elec_id)] for elec_id in range(1, NUM_ELECTORATES[year]+1))
+    return result
 
 if __name__ == "__main__":
     import argparse
@@ -0,0 +1,188 @@
+"""Parses many saved On the Fence results pages into one table.
+
+Snapshots are given as files, directories (every .html or .htm file in
+them) or glob patterns. Each snapshot's time is taken from its filename if
+it has a date in it, like "onthefence-2020-09-01T1200.html", and otherwise
+from when the file was last modified. Snapshots are parsed in parallel and
+appended, in time order, to a CSV table with a row for each party's position
+on each question, and/or to a JSON Lines file with a line for each snapshot.
+
+Snapshots are identified by the SHA-256 of their contents. Any snapshot that
+is already in every output file, or has the same contents as an earlier one,
+is skipped, so the same command can be run again as snapshots are added. A
+snapshot that is in only some of the output files is written to the others.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+
+import onthefence
+
+CSV_HEADER = ["Time", "File", "SHA-256", "Title", "Type", "Party", "Position"]
+SNAPSHOT_EXTENSIONS = (".html", ".htm")
+TIME_PATTERN = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})(?:[T_ -]?(\d{2})[:.-]?(\d{2})(?:[:.-]?(\d{2}))?)?")
+
+
+def find_snapshots(patterns):
+    """Returns the files matched by 'patterns', each a file, directory or glob
+    pattern, without duplicates."""
+    filenames = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            filenames.extend(sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                    if name.lower().endswith(SNAPSHOT_EXTENSIONS)))
+        elif os.path.isfile(pattern):
+            filenames.append(pattern)
+        else:
+            filenames.extend(sorted(glob.glob(pattern)))
+    return list(dict.fromkeys(os.path.normpath(filename) for filename in filenames))
+
+
+def snapshot_time(filename):
+    """Returns the time of a snapshot as an ISO 8601 string, from its filename
+    if possible, otherwise from its modification time."""
+    match = TIME_PATTERN.search(os.path.basename(filename))
+    if match:
+        try:
+            time = datetime.datetime(*(int(field) for field in match.groups() if field is not None))
+        except ValueError:
+            pass
+        else:
+            return time.isoformat()
+    time = datetime.datetime.fromtimestamp(os.path.getmtime(filename))
+    return time.replace(microsecond=0).isoformat()
+
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def processed_hashes(csv_filename=None, json_filename=None):
+    """Returns the sets of snapshot hashes that are already in the CSV and
+    JSON output files, each None if that output file isn't given."""
+    csv_seen = json_seen = None
+    if csv_filename:
+        csv_seen = set()
+        if os.path.exists(csv_filename):
+            with open(csv_filename, newline="") as f:
+                csv_seen = set(row["SHA-256"] for row in csv.DictReader(f))
+    if json_filename:
+        json_seen = set()
+        if os.path.exists(json_filename):
+            with open(json_filename) as f:
+                json_seen = set(json.loads(line)["sha256"] for line in f if line.strip())
+    return csv_seen, json_seen
+
+
+def _parse_snapshot(filename, include_your_response=True, fast=False):
+    """Worker for parse_snapshots(). Returns the filename and what
+    onthefence.parse() returns for the file."""
+    with open(filename, encoding="utf-8") as f:
+        return filename, onthefence.parse(f.read(), include_your_response, fast)
+
+
+def parse_snapshots(snapshots, jobs=1, include_your_response=True, fast=False):
+    """Parses snapshots, a list of filenames, in up to 'jobs' worker processes
+    (all available cores if 'jobs' is None). Yields (filename, questions)
+    pairs in the same order as 'snapshots', as they're parsed."""
+    args = (snapshots, itertools.repeat(include_your_response), itertools.repeat(fast))
+    if jobs == 1:
+        yield from map(_parse_snapshot, *args)
+        return
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        yield from executor.map(_parse_snapshot, *args, chunksize=4)
+
+
+def csv_rows(time, filename, sha256, questions):
+    """Returns the rows of the CSV table for one snapshot."""
+    for question in questions:
+        for data in question["parties"]:
+            position = data["position"] if data["position"] is not None else ""
+            yield [time, filename, sha256, question["title"], question["type"], data["party"], position]
+
+
+def run(patterns, csv_filename=None, json_filename=None, jobs=1, include_your_response=True, fast=False, quiet=False):
+    """Parses the snapshots matched by 'patterns' that aren't already in every
+    output file, and appends each to the output files that don't have it.
+    Returns the number of snapshots parsed and the number skipped."""
+    csv_seen, json_seen = processed_hashes(csv_filename, json_filename)
+    seen = [hashes for hashes in (csv_seen, json_seen) if hashes is not None]
+    snapshots = dict() # hash -> (time, filename), earliest for each hash
+    skipped = 0
+    for filename in find_snapshots(patterns):
+        sha256 = file_hash(filename)
+        time = snapshot_time(filename)
+        if all(sha256 in hashes for hashes in seen) or (sha256 in snapshots and snapshots[sha256] <= (time, filename)):
+            skipped += 1
+            continue
+        if sha256 in snapshots:
+            skipped += 1
+        snapshots[sha256] = (time, filename)
+
+    order = sorted(snapshots, key=snapshots.get)
+    filenames = [snapshots[sha256][1] for sha256 in order]
+
+    csv_file = json_file = None
+    if csv_filename:
+        new_file = not os.path.exists(csv_filename) or os.path.getsize(csv_filename) == 0
+        csv_file = open(csv_filename, 'a', newline="")
+        writer = csv.writer(csv_file)
+        if new_file:
+            writer.writerow(CSV_HEADER)
+    if json_filename:
+        json_file = open(json_filename, 'a')
+
+    try:
+        results = parse_snapshots(filenames, jobs, include_your_response, fast)
+        for sha256, (filename, questions) in zip(order, results):
+            time = snapshots[sha256][0]
+            if csv_file and sha256 not in csv_seen:
+                writer.writerows(csv_rows(time, filename, sha256, questions))
+                csv_file.flush()
+            if json_file and sha256 not in json_seen:
+                json_file.write(json.dumps({"time": time, "file": filename, "sha256": sha256, "questions": questions}) + "\n")
+                json_file.flush()
+            if not quiet:
+                print("{0:s}  {1:s}".format(time, filename))
+    finally:
+        for f in (csv_file, json_file):
+            if f:
+                f.close()
+
+    return len(filenames), skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("snapshots", nargs="+", help="Snapshot files, directories or glob patterns")
+    parser.add_argument("-j", "--json", metavar="FILE",
+        help="Append a line of JSON for each snapshot to this file")
+    parser.add_argument("-c", "--csv", metavar="FILE",
+        help="Append rows for each snapshot to this CSV file")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+        help="Parse snapshots in this many processes (0 for one per core)")
+    parser.add_argument("-q", "--quiet", action="store_true",
+        help="Don't print each snapshot as it's parsed")
+    parser.add_argument("-x", "--no-your-response", action="store_false", dest="include_your_response",
+        help="Exclude the 'Your Response' column")
+    parser.add_argument("-f", "--fast", action="store_true",
+        help="Parse only the results grid, using lxml if it's installed")
+    args = parser.parse_args()
+
+    if not args.csv and not args.json:
+        parser.error("at least one of --csv and --json is required")
+
+    parsed, skipped = run(args.snapshots, args.csv, args.json, args.processes or None,
+            args.include_your_response, args.fast, args.quiet)
+    print("Parsed {0:d} snapshots, skipped {1:d} already processed or duplicated".format(parsed, skipped))
@@ -0,0 +1,117 @@
+"""Benchmark for the On the Fence scraper.
+
+Builds a results page from scraped-onthefence.json, laid out the way
+onthefence.py expects, with filler sections, scripts and styles around the
+results grid to stand in for the rest of a saved page. Each parse mode is
+checked against the fixture, and then timed. The "strainer" mode is the fast
+path without lxml, whether or not lxml is installed.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+
+import argparse
+import html
+import json
+import os
+import statistics
+import time
+
+import onthefence
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraped-onthefence.json")
+
+MODES = {
+    "default": dict(fast=False),
+    "fast": dict(fast=True),
+    "strainer": dict(fast=True, use_lxml=False),
+}
+
+
+def scale_item(question):
+    parts = ['<div class="grid-item"><div class="front"><div class="result-stats-wrapper">']
+    for data in question["parties"]:
+        parts.append('<p class="party">{0}</p>'.format(html.escape(data["party"])))
+        if data["position"] is None:
+            parts.append('<div class="result-chart"><p class="no-response">No response</p></div>')
+        else:
+            left = round(data["position"] * 50)
+            parts.append('<div class="result-chart"><div class="bar"><div class="marker" style="left: {0:d}%;"></div></div></div>'.format(left))
+    parts.append('</div></div><div class="back"><div><h2>{0}</h2><div><p>{1}</p></div>'.format(
+            html.escape(question["title"]), html.escape(question["text"])))
+    parts.append('<div class="issue-options"><span class="text-left">{0}</span><span class="text-right">{1}</span></div>'.format(
+            html.escape(question["left-option"]), html.escape(question["right-option"])))
+    parts.append('</div></div></div>\n')
+    return "".join(parts)
+
+
+def likert_item(question):
+    parts = ['<div class="grid-item"><div class="front"><div class="result-stats-wrapper">']
+    for data in question["parties"]:
+        parts.append('<p class="party">{0}</p><div class="result-lines">'.format(html.escape(data["party"])))
+        for i in range(1, 6):
+            parts.append('<div class="full-width{0}"></div>'.format(" selected" if i == data["position"] else ""))
+        parts.append('</div>')
+    parts.append('</div></div><div class="back"><div><h2>{0}</h2><div><p>{1}</p></div></div></div></div>\n'.format(
+            html.escape(question["title"]), html.escape(question["text"])))
+    return "".join(parts)
+
+
+def your_response(question):
+    """Returns a copy of 'question' with a "Your Response" party added."""
+    position = 0.5 if "left-option" in question else 3
+    return dict(question, parties=question["parties"] + [{"party": "Your Response", "position": position}])
+
+
+def filler_section(index, paragraphs):
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit &amp; sed do eiusmod tempor. " * 4
+    body = "".join('<div class="row"><p class="text-{0:d}">{1}<a href="#q{2:d}">more</a></p></div>\n'.format(
+            index, text, i) for i in range(paragraphs))
+    return '<section id="section-{0:d}"><div class="container">{1}</div></section>\n'.format(index, body)
+
+
+def build_page(questions, filler=200):
+    """Returns HTML for a results page with these questions. The first 12
+    questions must be scale questions and the rest Likert questions."""
+    head = ('<!DOCTYPE html>\n<html lang="en"><head><meta charset="utf-8"><title>On the Fence</title>\n'
+            '<style>' + ".c{0:d} {{ margin: {0:d}px; }}\n".format(0) * 2000 + '</style>\n'
+            '<script>' + "var x = [1, 2, 3] < 4;\n" * 2000 + '</script></head><body>\n')
+    sections = [filler_section(i, filler) for i in range(5)]
+    grid = "".join(scale_item(q) for q in questions[:12]) + "".join(likert_item(q) for q in questions[12:])
+    sections.append('<section id="results"><div class="container"><h1>Results</h1><div class="grid">\n' + grid + '</div></div></section>\n')
+    sections.append(filler_section(6, filler // 4))
+    return head + "".join(sections) + '<footer><p>On the Fence</p></footer></body></html>\n'
+
+
+def expected(questions):
+    """Returns what onthefence.parse() should return for the fixture."""
+    result = [dict(q, type="scale" if "left-option" in q else "likert") for q in questions]
+    result.sort(key=lambda q: (q["type"] == "likert", q["title"]))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="Times to parse the page in each mode")
+    parser.add_argument("--filler", type=int, default=200, help="Filler paragraphs in each other section")
+    parser.add_argument("--html", metavar="FILE", type=argparse.FileType("w"),
+        help="Also write the generated page to this file")
+    args = parser.parse_args()
+
+    with open(FIXTURE) as f:
+        questions = json.load(f)
+    page = build_page([your_response(q) for q in questions], args.filler)
+    if args.html:
+        args.html.write(page)
+
+    print("Page is {0:d} KB; lxml is {1:s}".format(len(page.encode()) // 1024,
+            "installed" if onthefence.lxml else "not installed"))
+    print("{0:<10s} {1:>10s} {2:>10s}".format("mode", "mean (ms)", "min (ms)"))
+    for mode, kwargs in MODES.items():
+        if onthefence.parse(page, include_your_response=False, **kwargs) != expected(questions):
+            raise AssertionError("{0} mode doesn't match {1}".format(mode, FIXTURE))
+        times = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            onthefence.parse(page, **kwargs)
+            times.append(time.perf_counter() - start)
+        print("{0:<10s} {1:10.1f} {2:10.1f}".format(mode, statistics.mean(times) * 1000, min(times) * 1000))
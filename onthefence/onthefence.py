@@ -2,38 +2,55 @@
 
 Subject to break if On the Fence changes its web page layout.
 
+With --fast, lxml (if it's installed) finds the results grid, and only the
+grid is parsed by BeautifulSoup, rather than the whole page. Without lxml,
+BeautifulSoup still reads the whole page but builds only the grid, which is
+about half the work. The output is the same.
+
 Chuan-Zheng Lee <czlee@stanford.edu>
 August 2020
 """
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import argparse
 import csv
 import json
 import re
 import urllib.request
 
-parser = argparse.ArgumentParser()
-parser.add_argument("file", type=argparse.FileType("r"))
-parser.add_argument("-j", "--json", metavar="FILE", type=argparse.FileType("w"),
-    help="Write JSON to this output file")
-parser.add_argument("-c", "--csv", metavar="FILE", type=argparse.FileType("w"),
-    help="Write CSV to this output file")
-parser.add_argument("-q", "-quiet", action="store_false", dest="print",
-    help="Don't print summary output")
-parser.add_argument("-x", "--no-your-response", action="store_false", dest="include_your_response",
-    help="Exclude the 'Your Response' column")
-args = parser.parse_args()
-
-soup = BeautifulSoup(args.file.read(), "html.parser")
-grid = soup.find_all("section")[5].div.find("div", "grid")
-items = grid.find_all("div", "grid-item")
-
-scraped = []
-
-# Percentage scale questions
-
-for item in items[:12]:
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+LEFT_PATTERN = re.compile(r"left: (\d+)%;")
+
+# Same as soup.find_all("section")[5].div.find("div", "grid")
+GRID_XPATH = ("(//section)[6]/descendant::div[1]"
+              "/descendant::div[contains(concat(' ', normalize-space(@class), ' '), ' grid ')][1]")
+
+
+def get_grid_items(html, fast=False, use_lxml=True):
+    """Returns the grid items (one per question) on the results page. If
+    'fast' is True and lxml is installed, lxml finds the results grid, and
+    only the grid is parsed by BeautifulSoup. Without lxml, or if 'use_lxml'
+    is False, only "grid" <div> elements are kept by BeautifulSoup, and the
+    results grid is the one with grid items in it."""
+    if fast and use_lxml and lxml is not None:
+        grid = lxml.html.document_fromstring(html).xpath(GRID_XPATH)[0]
+        soup = BeautifulSoup(lxml.html.tostring(grid, encoding="unicode", with_tail=False), "lxml")
+        grid = soup.find("div")
+    elif fast:
+        soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("div", class_="grid"))
+        grid = next(grid for grid in soup.find_all("div", "grid") if grid.find("div", "grid-item"))
+    else:
+        soup = BeautifulSoup(html, "html.parser")
+        grid = soup.find_all("section")[5].div.find("div", "grid")
+    return grid.find_all("div", "grid-item")
+
+
+def parse_scale_question(item, include_your_response=True):
+    """Parses a percentage scale question."""
     question = {}
 
     results = item.find("div", "result-stats-wrapper")
@@ -48,7 +65,7 @@ for item in items[:12]:
         data["party"] = party.text
 
         if position.div:
-            match = re.match(r"left: (\d+)%;", position.div.div["style"])
+            match = LEFT_PATTERN.match(position.div.div["style"])
             left = match.group(1)
             data["position"] = int(left) / 50
         elif position.p and "no-response" in position.p.get("class", []):
@@ -56,7 +73,7 @@ for item in items[:12]:
         else:
             raise AssertionError
 
-        if data["party"] != "Your Response" or args.include_your_response:
+        if data["party"] != "Your Response" or include_your_response:
             question["parties"].append(data)
 
     back = item.find("div", "back")
@@ -67,11 +84,11 @@ for item in items[:12]:
     question["right-option"] =  issue_options.find("span", "text-right").text
     question["type"] = "scale"
 
-    scraped.append(question)
+    return question
 
-# Likert questions
 
-for item in items[12:]:
+def parse_likert_question(item, include_your_response=True):
+    """Parses a Likert (five-point) question."""
     question = {}
 
     results = item.find("div", "result-stats-wrapper")
@@ -85,7 +102,7 @@ for item in items[12:]:
         selected = ["selected" in x["class"] for x in position.find_all("div", "full-width")]
         data["position"] = selected.index(True) + 1
 
-        if data["party"] != "Your Response" or args.include_your_response:
+        if data["party"] != "Your Response" or include_your_response:
             question["parties"].append(data)
 
     back = item.find("div", "back")
@@ -93,18 +110,22 @@ for item in items[12:]:
     question["text"] = back.div.div.text
     question["type"] = "likert"
 
-    scraped.append(question)
+    return question
 
 
-scraped.sort(key=lambda q: (q["type"] == "likert", q["title"]))
+def parse(html, include_your_response=True, fast=False, use_lxml=True):
+    """Parses the results page, and returns a list of questions, each a dict
+    with the parties' positions."""
+    items = get_grid_items(html, fast, use_lxml)
+    scraped = [parse_scale_question(item, include_your_response) for item in items[:12]]
+    scraped += [parse_likert_question(item, include_your_response) for item in items[12:]]
+    scraped.sort(key=lambda q: (q["type"] == "likert", q["title"]))
+    return scraped
 
 
-if args.json:
-    json.dump(scraped, args.json, indent=4)
-
-
-if args.csv or args.print:
-
+def position_table(scraped):
+    """Returns a sorted list of all parties, and a list of each question's
+    positions for those parties (None where a party has no position)."""
     parties = set(data["party"] for question in scraped for data in question["parties"])
     parties = sorted(parties)
 
@@ -114,21 +135,54 @@ if args.csv or args.print:
         positions = [positions_by_party.get(party) for party in parties]
         position_columns.append(positions)
 
+    return parties, position_columns
+
+
+def write_csv(scraped, file):
+    parties, position_columns = position_table(scraped)
+    writer = csv.writer(file)
+    writer.writerow(["Title", "Text", "Left option", "Right option"] + parties)
+    for question, positions in zip(scraped, position_columns):
+        row = [question["title"]]
+        row.extend(positions)
+        row.extend([
+            question["text"],
+            question.get("left-option", ""),
+            question.get("right-option", ""),
+        ])
+        writer.writerow(row)
+
+
+def print_summary(scraped):
+    parties, position_columns = position_table(scraped)
+    print("Question".ljust(20) + " " + " ".join(party[:5].rjust(5) for party in parties))
+    for question, positions in zip(scraped, position_columns):
+        position_str = " ".join([str(pos if pos is not None else "N/A").rjust(5) for pos in positions])
+        print(f"{question['title']:<20} {position_str}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", type=argparse.FileType("r"))
+    parser.add_argument("-j", "--json", metavar="FILE", type=argparse.FileType("w"),
+        help="Write JSON to this output file")
+    parser.add_argument("-c", "--csv", metavar="FILE", type=argparse.FileType("w"),
+        help="Write CSV to this output file")
+    parser.add_argument("-q", "-quiet", action="store_false", dest="print",
+        help="Don't print summary output")
+    parser.add_argument("-x", "--no-your-response", action="store_false", dest="include_your_response",
+        help="Exclude the 'Your Response' column")
+    parser.add_argument("-f", "--fast", action="store_true",
+        help="Parse only the results grid, using lxml if it's installed")
+    args = parser.parse_args()
+
+    scraped = parse(args.file.read(), args.include_your_response, args.fast)
+
+    if args.json:
+        json.dump(scraped, args.json, indent=4)
+
     if args.csv:
-        writer = csv.writer(args.csv)
-        writer.writerow(["Title", "Text", "Left option", "Right option"] + parties)
-        for question, positions in zip(scraped, position_columns):
-            row = [question["title"]]
-            row.extend(positions)
-            row.extend([
-                question["text"],
-                question.get("left-option", ""),
-                question.get("right-option", ""),
-            ])
-            writer.writerow(row)
+        write_csv(scraped, args.csv)
 
     if args.print:
-        print("Question".ljust(20) + " " + " ".join(party[:5].rjust(5) for party in parties))
-        for question, positions in zip(scraped, position_columns):
-            position_str = " ".join([str(pos if pos is not None else "N/A").rjust(5) for pos in positions])
-            print(f"{question['title']:<20} {position_str}")
+        print_summary(scraped)
@@ -0,0 +1,126 @@
+# coding: utf-8
+"""Registry of parties across elections.
+
+Party names in the results files change from year to year ("ACT" and "ACT New
+Zealand"), and some have lost their macrons or been mis-decoded ("Maori
+Party", "M�ori Party"). The registry maps every name to a canonical party
+with an integer ID, so that vote arrays from different years can be aligned
+into columns by ID. The parties in CANONICAL_PARTIES always have the same
+IDs; other parties are given the next free ID when first seen.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import re
+import threading
+import unicodedata
+import numpy
+
+# Canonical names, in ID order, with other names each party has appeared as
+CANONICAL_PARTIES = [
+    ("ACT New Zealand", ["ACT"]),
+    ("Advance NZ", []),
+    ("Alliance", []),
+    ("Conservative", ["Conservative Party"]),
+    ("Green Party", []),
+    ("Internet MANA", []),
+    ("Labour Party", []),
+    ("Mana", []),
+    ("Māori Party", []),
+    ("National Party", []),
+    ("New Conservative", []),
+    ("New Zealand First Party", ["NZ First"]),
+    ("Progressive", ["Jim Anderton's Progressive", "Progressive Coalition"]),
+    ("The Opportunities Party (TOP)", []),
+    ("United Future", ["United Future New Zealand"]),
+    ("United NZ", []),
+]
+
+def normalize_name(name):
+    """Returns the key used to match party names: without macrons or other
+    accents, case-folded and with single spaces."""
+    text = unicodedata.normalize("NFKD", name)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.casefold().split())
+
+def repair_name(name):
+    """Returns the name with UTF-8 that was mis-decoded as Latin-1 or
+    Windows-1252 (e.g. "MÄ\\x81ori") decoded properly, if it was."""
+    for encoding in ("cp1252", "latin-1"):
+        try:
+            return name.encode(encoding).decode("utf-8")
+        except UnicodeError:
+            pass
+    return name
+
+
+class PartyRegistry(object):
+    """Assigns each party an integer ID, and aligns per-year party columns."""
+
+    def __init__(self, canonical=CANONICAL_PARTIES):
+        self.names = [] # canonical name for each ID
+        self._keys = dict() # normalized name -> ID
+        self._cache = dict() # name as given -> ID
+        self._lock = threading.Lock()
+        for name, aliases in canonical:
+            party_id = self._add(name)
+            for alias in aliases:
+                self._keys[normalize_name(alias)] = party_id
+
+    def __len__(self):
+        return len(self.names)
+
+    def _add(self, name):
+        self.names.append(name)
+        self._keys[normalize_name(name)] = len(self.names) - 1
+        return len(self.names) - 1
+
+    def _find(self, name):
+        key = normalize_name(repair_name(name))
+        if key in self._keys:
+            return self._keys[key]
+        if "�" in key:
+            # A character that couldn't be decoded; match it against anything
+            pattern = re.compile(".".join(map(re.escape, key.split("�"))) + "$")
+            matches = set(party_id for k, party_id in self._keys.items() if pattern.match(k))
+            if len(matches) == 1:
+                return matches.pop()
+        return None
+
+    def id(self, name):
+        """Returns the ID for a party name, registering it if it's new."""
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        with self._lock:
+            party_id = self._find(name)
+            if party_id is None:
+                party_id = self._add(name)
+            self._cache[name] = party_id
+        return party_id
+
+    def ids(self, names):
+        """Returns the IDs for a list of party names, as an int array."""
+        return numpy.array([self.id(name) for name in names], dtype=numpy.intp)
+
+    def name(self, party_id):
+        """Returns the canonical name for an ID."""
+        return self.names[party_id]
+
+    def canonical(self, name):
+        """Returns the canonical name for a party name."""
+        return self.names[self.id(name)]
+
+    def align(self, party_ids, votes, size=None):
+        """Returns 'votes', whose last axis has a column for each of
+        'party_ids', with its last axis spread out to a column for every ID
+        (up to 'size', by default every ID registered so far). Parties that
+        aren't in 'party_ids' get zeros."""
+        if len(set(party_ids.tolist())) != len(party_ids):
+            raise ValueError("Two parties have the same ID: {0}".format([self.names[i] for i in party_ids]))
+        votes = numpy.asarray(votes)
+        aligned = numpy.zeros(votes.shape[:-1] + (size or len(self),), dtype=votes.dtype)
+        aligned[..., party_ids] = votes
+        return aligned
+
+registry = PartyRegistry()
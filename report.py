@@ -0,0 +1,233 @@
+# coding: utf-8
+"""Report tables for vote statistics.
+
+The numbers for a report are computed first, as whole arrays, and formatted
+afterwards. The table functions can be used on their own to get the numbers.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import numpy
+import timings
+from config import MAJOR_PARTIES
+from parties import registry as party_registry
+
+STATS_ATTRIBUTES = ["ordinary", "ordinary_polling_places", "advance", "domestic", "specials", "specials_domestic", "overseas", "totals"]
+STATS_HEADER = "Party".ljust(35) + "Ordinary   Polling   Advance  Domestic  Specials  DomSpecs  Overseas     Total"
+
+# Comparisons are between pairs of these categories
+CATEGORIES = ["overseas", "domestic", "specials_domestic", "specials", "ordinary"]
+COMPARISONS = [
+    ("overseas", "domestic"),
+    ("overseas", "specials_domestic"),
+    ("overseas", "ordinary"),
+    ("specials_domestic", "ordinary"),
+    ("specials", "ordinary"),
+]
+COMPARISONS_HEADER = "     Ovs/Dom   Ovs/DS  Ovs/Ord   DS/Ord Spec/Ord"
+
+_left = [CATEGORIES.index(a) for a, b in COMPARISONS]
+_right = [CATEGORIES.index(b) for a, b in COMPARISONS]
+
+# The categories are sums of these disjoint components, which are what
+# bootstrap resamples are drawn from: CATEGORY_COMPONENTS[i, j] is 1 if
+# component j counts towards category i
+COMPONENTS = ["overseas", "specials_domestic", "ordinary"]
+CATEGORY_COMPONENTS = numpy.array([
+    [1, 0, 0], # overseas
+    [0, 1, 1], # domestic
+    [0, 1, 0], # specials_domestic
+    [1, 1, 0], # specials
+    [0, 0, 1], # ordinary
+], dtype=numpy.int64)
+
+# Largest number of vote counts drawn at once, to bound memory use
+MAX_RESAMPLE_SIZE = 2 ** 23
+
+def aligned_votes(stats_list, categories=CATEGORIES):
+    """Returns a (row x category x party) int64 array of the votes in each of
+    'categories' for each statistics object in 'stats_list', with a column
+    for every party in the party registry, by ID. Rows may come from
+    elections with different party lists."""
+    party_ids = [stats.party_ids for stats in stats_list] # registers any new parties
+    size = len(party_registry)
+    votes = numpy.zeros((len(stats_list), len(categories), size), dtype=numpy.int64)
+    for row, stats in enumerate(stats_list):
+        array = numpy.array([getattr(stats, category)._votes for category in categories], dtype=numpy.int64)
+        votes[row] = party_registry.align(party_ids[row], array, size)
+    return votes
+
+def category_votes(stats_list, parties, categories=CATEGORIES):
+    """Returns a (row x category x party) int64 array of the votes for each
+    of 'parties' in each of 'categories', for each statistics object in
+    'stats_list'. Parties are looked up in the party registry, so rows may
+    come from elections with different party lists or party names."""
+    party_ids = party_registry.ids(parties)
+    return aligned_votes(stats_list, categories)[..., party_ids]
+
+def shares(votes, totals):
+    """Returns 'votes' as fractions of 'totals', treating a zero total like
+    VoteCounts.percentages does."""
+    totals = numpy.where(totals == 0, 0.1, totals)
+    return votes / totals
+
+def category_shares(stats_list, parties, categories=CATEGORIES):
+    """Like category_votes(), but each party's share of all votes in the
+    category, not just those of 'parties'."""
+    totals = numpy.array([[getattr(stats, category)._votes.sum() for category in categories] for stats in stats_list], dtype=numpy.int64)
+    return shares(category_votes(stats_list, parties, categories), totals.reshape(len(stats_list), len(categories), 1))
+
+def compare_shares(shares, type="ratio"):
+    """Computes COMPARISONS from an array of category shares whose last two
+    axes are (category x party), in the order of CATEGORIES. Returns an array
+    whose last two axes are (party x comparison)."""
+    left = shares[..., _left, :]
+    right = shares[..., _right, :]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        if type == "ratio":
+            result = left / right
+        elif type == "diff":
+            result = left - right
+        else:
+            raise ValueError("Unrecognized type: {0!r}".format(type))
+    return numpy.swapaxes(result, -1, -2)
+
+def comparison_table(stats_list, parties, type="ratio"):
+    """Returns a (row x party x comparison) array of the COMPARISONS for each
+    statistics object in 'stats_list' and each of 'parties'."""
+    return compare_shares(category_shares(stats_list, parties), type)
+
+def resample_votes(votes, resamples, rng=None):
+    """Returns 'resamples' multinomial resamples of 'votes', an int array whose
+    last axis is (party), as an array with an extra first axis. Each resample
+    spreads each row's total votes over the parties in proportion to the
+    observed votes, which is the same as resampling the ballots with
+    replacement. 'rng' is a numpy Generator or a seed."""
+    rng = numpy.random.default_rng(rng)
+    totals = votes.sum(axis=-1)
+    pvals = votes / numpy.where(totals == 0, 1, totals)[..., numpy.newaxis]
+    pvals[totals == 0, -1] = 1 # any valid probabilities; no votes are drawn
+    return rng.multinomial(totals, pvals, size=(resamples,) + totals.shape)
+
+def bootstrap_comparisons(stats_list, parties, type="ratio", resamples=1000, seed=None):
+    """Returns a (resample x row x party x comparison) array of the
+    COMPARISONS computed from resampled votes, for each statistics object in
+    'stats_list' and each of 'parties'. Each of the disjoint COMPONENTS is
+    resampled on its own, and the categories are then derived from them, so
+    that e.g. specials and overseas votes vary together."""
+    votes = aligned_votes(stats_list, COMPONENTS)
+    party_ids = party_registry.ids(parties)
+    # Only the parties compared and the rest as one are needed for the shares
+    others = votes.sum(axis=-1) - votes[..., party_ids].sum(axis=-1)
+    votes = numpy.concatenate([votes[..., party_ids], others[..., numpy.newaxis]], axis=-1)
+
+    rng = numpy.random.default_rng(seed)
+    result = numpy.empty((resamples, len(stats_list), len(parties), len(COMPARISONS)))
+    chunk = max(1, MAX_RESAMPLE_SIZE // max(1, votes.size))
+    for start in range(0, resamples, chunk):
+        stop = min(start + chunk, resamples)
+        categories = CATEGORY_COMPONENTS @ resample_votes(votes, stop - start, rng)
+        totals = categories.sum(axis=-1, keepdims=True)
+        result[start:stop] = compare_shares(shares(categories, totals)[..., :-1], type)
+    return result
+
+def comparison_intervals(stats_list, parties, type="ratio", resamples=1000, confidence=0.95, seed=None):
+    """Returns (lower, upper), two (row x party x comparison) arrays with the
+    bounds of bootstrap percentile intervals for the COMPARISONS. Resamples
+    where a comparison is undefined (0/0) are left out."""
+    table = bootstrap_comparisons(stats_list, parties, type, resamples, seed)
+    alpha = (1 - confidence) / 2
+    with numpy.errstate(invalid="ignore"):
+        lower, upper = numpy.nanpercentile(table, [100 * alpha, 100 * (1 - alpha)], axis=0)
+    return lower, upper
+
+def stats_table(stats, parties, type="percentage"):
+    """Returns a (party x attribute) array of percentages (as fractions) or
+    votes for each of STATS_ATTRIBUTES. Parties are looked up in the party
+    registry, so 'parties' may use other names for the same parties."""
+    attributes = numpy.array([getattr(stats, attribute)._votes for attribute in STATS_ATTRIBUTES])
+    party_ids = stats.party_ids.tolist()
+    columns = [party_ids.index(party_id) for party_id in party_registry.ids(parties).tolist()]
+    if type == "percentage":
+        table = shares(attributes, attributes.sum(axis=1, keepdims=True))
+    elif type == "votes":
+        table = attributes
+    else:
+        raise ValueError("Unrecognized type: {0!r}".format(type))
+    return table[:, columns].T
+
+def format_comparisons(values, type="ratio"):
+    """Formats a (party x comparison) array as the columns of one line."""
+    if type == "ratio":
+        fmt = "{0:>7.4f}"
+    else:
+        fmt = "{0:>+7.2%}"
+    return "".join("     " + "  ".join(fmt.format(value) for value in row) for row in values.tolist())
+
+def print_comparisons_heading(title, label, type="ratio"):
+    """Prints the two heading lines above a comparisons table, 'title' above
+    the row labels and 'label' as the heading of the row labels."""
+    header = COMPARISONS_HEADER * len(MAJOR_PARTIES)
+    if type == "diff":
+        header = header.replace("/", "-")
+    print(title.ljust(len(label) + 23) + "Greens" + " " * 42 + "Labour" + " " * 41 + "National")
+    print(label + header)
+
+def print_comparison_table(labels, table, type="ratio"):
+    """Prints a table returned by comparison_table(), starting each line with
+    the corresponding label."""
+    with timings.phase("format", "comparison"):
+        for label, values in zip(labels, table):
+            print(label + format_comparisons(values, type))
+
+def print_comparisons(labels, stats_list, parties, type="ratio"):
+    """Prints a line of comparisons for each statistics object in 'stats_list',
+    starting with the corresponding label."""
+    with timings.phase("format", "comparison"):
+        table = comparison_table(stats_list, parties, type)
+    print_comparison_table(labels, table, type)
+
+def print_comparison_intervals(labels, stats_list, parties, type="ratio", resamples=1000, confidence=0.95, seed=None):
+    """Like print_comparisons(), but after each line, prints the lower and
+    upper bounds of bootstrap confidence intervals from 'resamples' resamples."""
+    with timings.phase("format", "comparison"):
+        table = comparison_table(stats_list, parties, type)
+    with timings.phase("bootstrap", "comparison"):
+        lower, upper = comparison_intervals(stats_list, parties, type, resamples, confidence, seed)
+    with timings.phase("format", "comparison"):
+        for label, values, low, high in zip(labels, table, lower, upper):
+            print(label + format_comparisons(values, type))
+            print("lo".rjust(len(label)) + format_comparisons(low, type))
+            print("hi".rjust(len(label)) + format_comparisons(high, type))
+
+def print_stats_table(parties, table, type="percentage"):
+    """Prints a table returned by stats_table()."""
+    if type == "percentage":
+        fmt = "{0:8.2%}".format
+    else:
+        fmt = lambda value: str(value).rjust(8)
+    with timings.phase("format", "stats"):
+        print(STATS_HEADER)
+        for party, values in zip(parties, table.tolist()):
+            print(party[:35].ljust(35) + "  ".join(map(fmt, values)))
+
+def add_arguments(parser):
+    """Adds the year, the actions and the options that analyse.py and client.py
+    share to 'parser', an argparse.ArgumentParser. Returns the "actions" and
+    "options" argument groups, for each script to add its own to."""
+    parser.add_argument("year", nargs="?", type=int, default=2014)
+    actions = parser.add_argument_group("actions")
+    actions.add_argument("-t", "--total", action="store_true", help="National totals")
+    actions.add_argument("-e", "--electorate", nargs="+", metavar="ID", type=int, default=[], help="Specific electorate, ID is the electorate number")
+    actions.add_argument("-r", "--compare-overall", action="store_true", help="National specials comparisons for all years")
+    actions.add_argument("-s", "--compare-electorate", action="store_true", help="Specials comparisons by electorate")
+    options = parser.add_argument_group("options")
+    options.add_argument("-d", "--diffs", action="store_true", help="Use differences instead of ratios in overseas vs specials comparisons")
+    options.add_argument("-v", "--votes", action="store_true", help="In --total or --electorate, also print raw vote counts")
+    options.add_argument("-P", "--all-parties", action="store_true", help="Print all parties, not just significant ones")
+    return actions, options
+
+def print_stats(stats, parties, type="percentage"):
+    """Prints a table of each of STATS_ATTRIBUTES for each of 'parties'."""
+    with timings.phase("format", "stats"):
+        table = stats_table(stats, parties, type)
+    print_stats_table(parties, table, type)
@@ -0,0 +1,184 @@
+# coding: utf-8
+"""Local query server for New Zealand General Elections statistics.
+
+Loads every year once, keeps it in memory and answers queries over HTTP with
+JSON. Endpoints:
+
+    /years                              years loaded
+    /total/YEAR                         national statistics
+    /electorate/YEAR/ID                 statistics for one electorate
+    /polling-places/YEAR/ID             polling places in one electorate
+    /compare/overall                    specials comparisons for all years
+    /compare/electorates/YEAR           specials comparisons by electorate
+
+Statistics are returned as their basic fields, which client.py turns back into
+GeneralStatistics objects. Comparisons take "?type=diff" for differences
+instead of ratios.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import json
+import http.server
+import re
+import urllib.parse
+import report
+from config import MAJOR_PARTIES, YEARS
+from electorate import GeneralStatistics, load_years
+
+DEFAULT_ADDRESS = "127.0.0.1"
+DEFAULT_PORT = 8642
+
+
+class QueryError(Exception):
+    """Raised for queries that can't be answered, with the HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ElectionData(object):
+    """All loaded years, and the answer to each kind of query."""
+
+    def __init__(self, years, jobs=1):
+        self.nationals = load_years(years, jobs)
+
+    def _national(self, year):
+        try:
+            return self.nationals[int(year)]
+        except KeyError:
+            raise QueryError(404, "Year {0} isn't loaded".format(year))
+
+    def _electorate(self, year, elec_id):
+        try:
+            return self._national(year).electorates[int(elec_id)]
+        except KeyError:
+            raise QueryError(404, "No electorate {0} in {1}".format(elec_id, year))
+
+    @staticmethod
+    def _stats(stats):
+        return {
+            "parties": stats.parties,
+            "fields": GeneralStatistics.BASIC_FIELDS,
+            "votes": stats.as_array().tolist(),
+        }
+
+    @staticmethod
+    def _comparisons(labels, stats_list, type):
+        if type not in ("ratio", "diff"):
+            raise QueryError(400, "Unrecognized type: {0!r}".format(type))
+        return {
+            "labels": labels,
+            "parties": MAJOR_PARTIES,
+            "type": type,
+            "table": report.comparison_table(stats_list, MAJOR_PARTIES, type).tolist(),
+        }
+
+    def years(self):
+        return sorted(self.nationals)
+
+    def total(self, year):
+        return self._stats(self._national(year))
+
+    def electorate(self, year, elec_id):
+        es = self._electorate(year, elec_id)
+        return dict(self._stats(es), name=es.name, id=es.id)
+
+    def polling_places(self, year, elec_id):
+        es = self._electorate(year, elec_id)
+        if es.pprs is None:
+            return {"parties": es.parties, "polling_places": []}
+        return {
+            "parties": es.parties,
+            "polling_places": [{"id": ppr.id, "suburb": ppr.suburb, "location": ppr.location, "votes": ppr._votes.tolist()}
+                    for ppr in es.pprs],
+        }
+
+    def compare_overall(self, type="ratio"):
+        years = self.years()
+        return self._comparisons([str(year) for year in years], [self.nationals[year] for year in years], type)
+
+    def compare_electorates(self, year, type="ratio"):
+        national = self._national(year)
+        electorates = [national.electorates[elec_id] for elec_id in sorted(national.electorates)]
+        return self._comparisons([es.name for es in electorates], electorates, type)
+
+    # (path pattern, method, query parameters allowed)
+    ROUTES = [
+        (r"/years", "years", []),
+        (r"/total/(\d+)", "total", []),
+        (r"/electorate/(\d+)/(\d+)", "electorate", []),
+        (r"/polling-places/(\d+)/(\d+)", "polling_places", []),
+        (r"/compare/overall", "compare_overall", ["type"]),
+        (r"/compare/electorates/(\d+)", "compare_electorates", ["type"]),
+    ]
+    ROUTES = [(re.compile(pattern + "$"), name, allowed) for pattern, name, allowed in ROUTES]
+
+    def query(self, path):
+        """Returns the answer to a query, given its URL path and query string."""
+        url = urllib.parse.urlsplit(path)
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        for pattern, name, allowed in self.ROUTES:
+            match = pattern.match(url.path.rstrip("/"))
+            if match:
+                unknown = [key for key in params if key not in allowed]
+                if unknown:
+                    raise QueryError(400, "Unrecognized parameters: {0}".format(", ".join(unknown)))
+                return getattr(self, name)(*match.groups(), **params)
+        raise QueryError(404, "Unrecognized query: {0}".format(url.path))
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    """Answers GET requests from the server's ElectionData."""
+
+    protocol_version = "HTTP/1.1" # keep connections alive
+
+    def do_GET(self):
+        try:
+            status, result = 200, self.server.data.query(self.path)
+        except QueryError as e:
+            status, result = e.status, {"error": str(e)}
+        except Exception as e:
+            self.log_error("Error answering %s: %r", self.path, e)
+            status, result = 500, {"error": "Internal error: {0}".format(e)}
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class QueryServer(http.server.ThreadingHTTPServer):
+    """HTTP server answering queries from 'data', in a thread per connection."""
+
+    daemon_threads = True
+
+    def __init__(self, address, data, quiet=False):
+        super().__init__(address, QueryHandler)
+        self.data = data
+        self.quiet = quiet
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("year", nargs="*", type=int, default=YEARS, help="Years to load (default: all)")
+    parser.add_argument("-a", "--address", default=DEFAULT_ADDRESS, help="Address to listen on (default %(default)s)")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help="Port to listen on (default %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Parse results files in this many processes (0 for one per core)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Don't log each request")
+    args = parser.parse_args()
+
+    data = ElectionData(args.year, args.jobs or None)
+    server = QueryServer((args.address, args.port), data, args.quiet)
+    print("Serving {0} on http://{1}:{2:d}/".format(", ".join(map(str, data.years())), args.address, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
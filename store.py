@@ -0,0 +1,172 @@
+"""Columnar on-disk store for a whole election year.
+
+A store file holds every electorate's results for one year: a dense
+(electorate x field x party) vote array, a polling place table and the string
+dictionaries they refer to. It is read through a memory map, so the arrays are
+zero-copy NumPy views of the file, and several processes reading the same
+store share the same pages. Nothing is parsed when a store is opened.
+
+The file layout is:
+    8 bytes    magic, b"NZELSTOR"
+    8 bytes    length of the header, little-endian unsigned
+    header     JSON, UTF-8
+    arrays     each starting at a multiple of ALIGNMENT bytes
+Array offsets in the header are relative to the start of the file.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import json
+import mmap
+import os
+import numpy
+import container
+import download
+from electorate import ElectorateStatistics, GeneralStatistics, NationalStatistics, load_years
+
+MAGIC = b"NZELSTOR"
+VERSION = 1
+ALIGNMENT = 64
+
+def get_store_filename(year):
+    """Returns the store filename for this year."""
+    return os.path.join(download.RESULTS_DIR, "{0:d}.store".format(year))
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def write_store(national, filename):
+    """Writes the NationalStatistics 'national' to a store file."""
+    electorates = [national.electorates[elec_id] for elec_id in sorted(national.electorates)]
+
+    strings = dict() # string -> index, in order of first appearance
+    pp_electorate, pp_id, pp_suburb, pp_location, pp_votes = [], [], [], [], []
+    for index, es in enumerate(electorates):
+        table = es.pprs
+        remap = numpy.array([strings.setdefault(string, len(strings)) for string in table.strings], dtype=numpy.int32)
+        pp_electorate.append(numpy.full(len(table), index, dtype=numpy.int32))
+        pp_id.append(table.ids)
+        pp_suburb.append(remap[table.suburbs])
+        pp_location.append(remap[table.locations])
+        pp_votes.append(table.votes)
+
+    arrays = {
+        "votes": numpy.stack([es.as_array() for es in electorates]),
+        "pp_electorate": numpy.concatenate(pp_electorate),
+        "pp_id": numpy.concatenate(pp_id),
+        "pp_suburb": numpy.concatenate(pp_suburb),
+        "pp_location": numpy.concatenate(pp_location),
+        "pp_votes": numpy.concatenate(pp_votes),
+    }
+
+    header = {
+        "version": VERSION,
+        "year": national.year,
+        "parties": national.parties,
+        "fields": GeneralStatistics.BASIC_FIELDS,
+        "electorates": [{"electorate": es.electorate, "id": es.id, "name": es.name} for es in electorates],
+        "strings": list(strings),
+        "arrays": dict(),
+    }
+
+    # Offsets depend on the header length, which depends on the offsets, so
+    # reserve generously for the offset digits and pad the header with spaces.
+    names = sorted(arrays)
+    for name in names:
+        header["arrays"][name] = {"dtype": arrays[name].dtype.str, "shape": arrays[name].shape, "offset": 0}
+    header_length = len(json.dumps(header).encode()) + 20 * len(names)
+    offset = _align(container.PREFIX_LENGTH + header_length)
+    for name in names:
+        header["arrays"][name]["offset"] = offset
+        offset = _align(offset + arrays[name].nbytes)
+
+    with container.atomic_write(filename) as f:
+        container.write_header(f, MAGIC, header, header_length)
+        for name in names:
+            f.write(b"\0" * (header["arrays"][name]["offset"] - f.tell()))
+            f.write(numpy.ascontiguousarray(arrays[name]).tobytes())
+
+
+class ElectionStore(object):
+    """A store file opened for reading. The arrays in 'arrays' are read-only
+    views into the memory-mapped file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header, start = container.read_header(self._mmap, MAGIC, VERSION, filename, "election store")
+
+        self.year = header["year"]
+        self.parties = header["parties"]
+        self.fields = header["fields"]
+        self.electorate_info = header["electorates"]
+        self.strings = header["strings"]
+        self.arrays = dict()
+        for name, info in header["arrays"].items():
+            dtype = numpy.dtype(info["dtype"])
+            count = int(numpy.prod(info["shape"]))
+            array = numpy.frombuffer(self._mmap, dtype=dtype, count=count, offset=info["offset"])
+            self.arrays[name] = array.reshape(info["shape"])
+
+        # Polling place rows for each electorate are contiguous
+        self._pp_bounds = numpy.searchsorted(self.arrays["pp_electorate"], numpy.arange(len(self.electorate_info) + 1))
+
+    def electorate(self, elec_id):
+        """Returns the ElectorateStatistics for this electorate number. Its
+        vote counts are views into the store."""
+        index = [info["electorate"] for info in self.electorate_info].index(elec_id)
+        info = self.electorate_info[index]
+        votes = self.arrays["votes"][index]
+        start, stop = self._pp_bounds[index:index+2]
+        pprs = {
+            "ids": self.arrays["pp_id"][start:stop],
+            "suburbs": self.arrays["pp_suburb"][start:stop],
+            "locations": self.arrays["pp_location"][start:stop],
+            "strings": self.strings,
+            "votes": self.arrays["pp_votes"][start:stop],
+        }
+        snapshot = {
+            "parties": self.parties,
+            "affiliations": None,
+            "name": info["name"],
+            "id": info["id"],
+            "special": {field: votes[i] for i, field in enumerate(self.fields) if field in ElectorateStatistics.SPECIAL_FIELDS},
+            "pprs": pprs,
+            "polling_places": self.arrays["pp_votes"][start:stop].sum(axis=0),
+        }
+        es = ElectorateStatistics(self.year, elec_id, init=False)
+        es.load_snapshot(snapshot)
+        return es
+
+    def national(self):
+        """Returns the NationalStatistics for the whole year."""
+        national = NationalStatistics(self.year, init=False)
+        national.set_electorates(self.electorate(info["electorate"]) for info in self.electorate_info)
+        return national
+
+
+def export_years(years, jobs=1):
+    """Parses the results files for each year and writes them to stores."""
+    for year, national in load_years(years, jobs).items():
+        write_store(national, get_store_filename(year))
+
+def open_store(year):
+    """Opens the store for this year."""
+    return ElectionStore(get_store_filename(year))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=["export", "info"])
+    parser.add_argument("year", nargs="+", type=int)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Parse results files in this many processes (0 for one per core)")
+    args = parser.parse_args()
+
+    if args.action == "export":
+        export_years(args.year, args.jobs or None)
+    elif args.action == "info":
+        for year in args.year:
+            store = open_store(year)
+            print("{0}: {1:d} electorates, {2:d} parties, {3:d} polling places, {4:,d} bytes".format(
+                    store.filename, len(store.electorate_info), len(store.parties),
+                    len(store.arrays["pp_id"]), os.path.getsize(store.filename)))
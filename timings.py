@@ -0,0 +1,130 @@
+"""Lightweight per-phase timing instrumentation.
+
+Code that does something worth timing wraps it in a phase:
+
+    with timings.phase("parse", (year, elec_id)) as record:
+        ...
+        record.bytes += len(data)
+
+Nothing is recorded unless 'enabled' is set, and a disabled phase costs about
+as much as an empty 'with' block. Each record keeps the number of calls, wall
+time and bytes, for each phase and for each key within the phase.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import json
+import threading
+import time
+
+enabled = False
+
+_records = dict() # (phase, key) -> Record
+_lock = threading.Lock()
+
+
+class Record(object):
+    """Call count, wall time and bytes for a phase and key."""
+
+    __slots__ = ("calls", "seconds", "bytes")
+
+    def __init__(self, calls=0, seconds=0.0, bytes=0):
+        self.calls = calls
+        self.seconds = seconds
+        self.bytes = bytes
+
+    def add(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.bytes += other.bytes
+
+    def as_dict(self):
+        return {"calls": self.calls, "seconds": self.seconds, "bytes": self.bytes}
+
+
+class _Phase(object):
+    """Context manager returned by phase(). The record it yields is added to
+    the totals when the block exits."""
+
+    __slots__ = ("name", "key", "record", "start")
+
+    def __init__(self, name, key):
+        self.name = name
+        self.key = key
+
+    def __enter__(self):
+        self.record = Record(calls=1)
+        self.start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc_info):
+        self.record.seconds = time.perf_counter() - self.start
+        with _lock:
+            _records.setdefault((self.name, self.key), Record()).add(self.record)
+
+
+class _NullPhase(object):
+    """Context manager returned by phase() when timing is disabled."""
+
+    def __enter__(self):
+        return Record()
+
+    def __exit__(self, *exc_info):
+        pass
+
+_null_phase = _NullPhase()
+
+
+def phase(name, key=None):
+    """Returns a context manager that times a block as part of phase 'name'.
+    'key' distinguishes, for example, electorates within a phase."""
+    if not enabled:
+        return _null_phase
+    return _Phase(name, key)
+
+def reset(enable=None):
+    """Clears all records, and if 'enable' isn't None, sets 'enabled' to it,
+    e.g. in a worker process that didn't inherit it."""
+    global enabled
+    if enable is not None:
+        enabled = enable
+    with _lock:
+        _records.clear()
+
+def drain():
+    """Removes and returns everything recorded so far, as a picklable dict,
+    e.g. to pass from a worker process to merge()."""
+    with _lock:
+        records = {key: record.as_dict() for key, record in _records.items()}
+        _records.clear()
+    return records
+
+def merge(records):
+    """Adds records returned by drain() to this process's records."""
+    with _lock:
+        for key, record in records.items():
+            _records.setdefault(key, Record()).add(Record(**record))
+
+def totals():
+    """Returns a dict mapping each phase to a dict with its totals and, under
+    "by_key", the records for each key."""
+    result = dict()
+    with _lock:
+        for (name, key), record in sorted(_records.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            entry = result.setdefault(name, dict(Record().as_dict(), by_key=dict()))
+            for field, value in record.as_dict().items():
+                entry[field] += value
+            if key is not None:
+                entry["by_key"][str(key)] = record.as_dict()
+    return result
+
+def print_summary(slowest=3, file=None):
+    """Prints the totals for each phase, and its slowest keys."""
+    print("Phase               Calls    Seconds          Bytes  Slowest", file=file)
+    for name, entry in sorted(totals().items(), key=lambda item: -item[1]["seconds"]):
+        keys = sorted(entry["by_key"].items(), key=lambda item: -item[1]["seconds"])[:slowest]
+        keys = ", ".join("{0} {1:.3f}s".format(key, record["seconds"]) for key, record in keys)
+        print("{0:<16} {1:8d} {2:10.3f} {3:14,d}  {4}".format(
+                name, entry["calls"], entry["seconds"], entry["bytes"], keys), file=file)
+
+def write_json(file):
+    json.dump(totals(), file, indent=2)
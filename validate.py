@@ -0,0 +1,114 @@
+# coding: utf-8
+"""Checks a whole year's results files for consistency, in one pass.
+
+The checks are:
+    parties     every electorate has the same party list
+    rows        every electorate has all the special vote rows
+    totals      ordinary and special votes add up to the totals row
+    negative    no polling place or other count is negative
+
+Electorates are loaded without their own totals check, and the checks are
+then done on (electorate x field x party) arrays for the whole year. The
+result is a report as a dict, which can be printed or written as JSON.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import collections
+import json
+import sys
+import numpy
+from config import NUM_ELECTORATES
+from electorate import ElectorateStatistics, GeneralStatistics, load_electorates
+
+FIELDS = GeneralStatistics.BASIC_FIELDS
+_totals = FIELDS.index("totals")
+# Fields that add up to the totals; ordinary_polling_places includes less_than_6
+_summed = [i for i, field in enumerate(FIELDS) if field not in ("totals", "less_than_6")]
+
+def _mismatches(electorates, expected, actual, check):
+    """Returns a list of failures, one for each (electorate, party) where the
+    arrays 'expected' and 'actual' (electorate x party) differ."""
+    failures = []
+    for row, column in zip(*numpy.nonzero(expected != actual)):
+        es = electorates[row]
+        failures.append({"check": check, "electorate": es.electorate, "name": es.name, "party": es.parties[column],
+                "expected": int(expected[row, column]), "actual": int(actual[row, column])})
+    return failures
+
+def validate_electorates(year, electorates):
+    """Checks a list of one year's ElectorateStatistics, and returns a report."""
+    report = {"year": year, "electorates": len(electorates), "checks": dict()}
+
+    # Party lists: the most common list is taken to be the right one
+    counts = collections.Counter(tuple(es.parties) for es in electorates)
+    parties = list(counts.most_common(1)[0][0])
+    failures = []
+    for es in electorates:
+        if es.parties != parties:
+            failures.append({"electorate": es.electorate, "name": es.name,
+                    "missing": [p for p in parties if p not in es.parties],
+                    "extra": [p for p in es.parties if p not in parties]})
+    report["parties"] = parties
+    report["checks"]["parties"] = failures
+
+    report["checks"]["rows"] = [{"electorate": es.electorate, "name": es.name, "missing": es.missing_rows}
+            for es in electorates if es.missing_rows]
+
+    # The array checks need a common party list, so skip electorates without it
+    electorates = [es for es in electorates if es.parties == parties]
+    array = numpy.stack([es.as_array() for es in electorates])
+
+    report["checks"]["totals"] = _mismatches(electorates, array[:, _totals], array[:, _summed].sum(axis=1), "totals")
+
+    failures = []
+    for es in electorates:
+        if es.pprs is not None and (es.pprs.votes < 0).any():
+            failures.append({"check": "negative booth votes", "electorate": es.electorate, "name": es.name,
+                    "booths": [int(ppr_id) for ppr_id in es.pprs.ids[(es.pprs.votes < 0).any(axis=1)]]})
+    for row, field in zip(*numpy.nonzero((array < 0).any(axis=2))):
+        es = electorates[row]
+        failures.append({"check": "negative votes", "electorate": es.electorate, "name": es.name, "field": FIELDS[field]})
+    report["checks"]["negative"] = failures
+
+    report["ok"] = not any(report["checks"].values())
+    return report
+
+def validate_year(year, jobs=1):
+    """Loads and checks every electorate in the year, and returns a report."""
+    keys = [(year, elec_id) for elec_id in range(1, NUM_ELECTORATES[year]+1)]
+    check_totals = ElectorateStatistics.check_totals
+    ElectorateStatistics.check_totals = False
+    try:
+        electorates = load_electorates(keys, jobs)
+    finally:
+        ElectorateStatistics.check_totals = check_totals
+    return validate_electorates(year, [electorates[key] for key in keys])
+
+def print_report(report, file=None):
+    """Prints a report from validate_year() in a readable form."""
+    print("{0:d}: {1:d} electorates, {2:s}".format(report["year"], report["electorates"],
+            "all checks passed" if report["ok"] else "FAILED"), file=file)
+    for check, failures in report["checks"].items():
+        print("  {0:<8s} {1:s}".format(check, "ok" if not failures else "{0:d} failures".format(len(failures))), file=file)
+        for failure in failures:
+            details = ", ".join("{0}={1}".format(key, value) for key, value in failure.items()
+                    if key not in ("electorate", "name"))
+            print("    electorate {0:d} {1:s}: {2:s}".format(failure["electorate"], failure["name"], details), file=file)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("year", nargs="+", type=int)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Parse results files in this many processes (0 for one per core)")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    reports = [validate_year(year, args.jobs or None) for year in args.year]
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+    else:
+        for report in reports:
+            print_report(report)
+    if not all(report["ok"] for report in reports):
+        sys.exit(1)
@@ -0,0 +1,91 @@
+# coding: utf-8
+"""Watches an election's results files and keeps the national totals current.
+
+Every so often, each electorate's results file is checked with a conditional
+request. Only files that have changed are downloaded and parsed again, and
+the national totals are updated by replacing just those electorates'
+contributions. After each update, the national table is printed again, or
+with --json, a line of JSON with the change in each field.
+
+Chuan-Zheng Lee <czlee@stanford.edu>
+"""
+import json
+import sys
+import time
+import download
+import report
+from config import PARTIES
+from electorate import NationalStatistics, load_electorates
+
+def check(national, jobs=1):
+    """Checks for changed results files, and updates 'national' with the
+    electorates whose files changed. Returns a list of their electorate
+    numbers and the change in the totals (None if nothing changed)."""
+    summary = download.download_all_polling_place_results(national.year, ["party"], force=True, quiet=True, jobs=jobs)
+    changed = sorted(elec_id for elec_id, vote_type in summary.changed)
+    if not changed:
+        return changed, None
+    electorates = load_electorates([(national.year, elec_id) for elec_id in changed], jobs)
+    return changed, national.update_electorates(electorates.values())
+
+def delta_json(year, changed, delta):
+    """Returns a dict describing an update, with only the non-zero changes."""
+    fields = dict()
+    for field in delta.BASIC_FIELDS:
+        votes = {party: value for party, value in getattr(delta, field).iter_votes() if value}
+        if votes:
+            fields[field] = votes
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "year": year,
+        "changed": changed,
+        "delta": fields,
+    }
+
+def watch(year, interval=60, jobs=1, output="table", parties=None, count=None):
+    """Checks for updates every 'interval' seconds, 'count' times (forever if
+    None), printing each update in the 'output' format."""
+    national = NationalStatistics(year, jobs=jobs)
+    parties = parties or national.parties
+    if output == "table":
+        print("National statistics for {0:d} election:".format(year))
+        report.print_stats(national, parties)
+
+    checks = 0
+    while count is None or checks < count:
+        time.sleep(interval)
+        checks += 1
+        try:
+            changed, delta = check(national, jobs)
+        except IOError as e:
+            print("Check failed: {0}".format(e), file=sys.stderr)
+            continue
+        if delta is None:
+            continue
+        if output == "json":
+            print(json.dumps(delta_json(year, changed, delta)), flush=True)
+        else:
+            print()
+            print("{0:s}: {1:d} electorates changed ({2:s})".format(
+                    time.strftime("%H:%M:%S"), len(changed), ", ".join(map(str, changed))))
+            report.print_stats(national, parties)
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("year", type=int)
+    parser.add_argument("-i", "--interval", type=float, default=60, help="Seconds between checks (default %(default)s)")
+    parser.add_argument("-n", "--count", type=int, default=None, help="Stop after this many checks")
+    parser.add_argument("-j", "--jobs", type=int, default=download.DEFAULT_JOBS, help="Concurrent downloads and parsing processes (default %(default)s)")
+    parser.add_argument("--json", action="store_true", help="Print a line of JSON for each update instead of a table")
+    parser.add_argument("-P", "--all-parties", action="store_true", help="Print all parties, not just significant ones")
+    parser.add_argument("--base-url", type=str, default=None, help="Download from this server instead, e.g. http://localhost:8000")
+    args = parser.parse_args()
+
+    download.BASE_URL = args.base_url
+    parties = None if args.all_parties else PARTIES[args.year]
+    try:
+        watch(args.year, args.interval, args.jobs or None, "json" if args.json else "table", parties, args.count)
+    except KeyboardInterrupt:
+        pass